@@ -0,0 +1,203 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import subprocess
+import tracemalloc
+import numpy as np
+from rich import print
+import utils
+import kernels
+from hmm import HMM
+
+
+def make_synthetic_points(n_samples: int, n_points: int, imgsz: int = 480, seed: int = 0):
+    """
+    Generate synthetic circle and square contours without rendering images.
+
+    Circles are sampled uniformly in angle, squares uniformly along the perimeter of a randomly shifted
+    quadrilateral, both with one pixel of noise and rounded to integer pixels like OpenCV contours.
+
+    Args:
+        n_samples (int): Number of samples, half circles (label 0) and half squares (label 1).
+        n_points (int): Number of contour points per sample.
+        imgsz (int, optional): Image size the contours fit in. Defaults to 480.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        tuple: Points (n_samples, n_points, 2) as int32 and labels (n_samples,).
+    """
+    rng = np.random.default_rng(seed)
+    labels = np.arange(n_samples) % 2
+    n_circle = int((labels == 0).sum())
+    n_square = n_samples - n_circle
+    points = np.empty((n_samples, n_points, 2), dtype=np.float64)
+
+    #? Circles
+    center = rng.uniform(imgsz / 4, 3 * imgsz / 4, size=(n_circle, 1, 2))
+    radius = rng.uniform(imgsz / 16, imgsz / 4, size=(n_circle, 1, 1))
+    theta = np.linspace(0, 2 * np.pi, n_points, endpoint=False) + rng.uniform(0, 2 * np.pi, size=(n_circle, 1))
+    points[labels == 0] = center + radius * np.stack([np.cos(theta), np.sin(theta)], axis=-1)
+
+    #? Squares, corners in order with a 10% shift
+    low = rng.uniform(0, imgsz / 3, size=(n_square, 1, 2))
+    high = rng.uniform(2 * imgsz / 3, imgsz, size=(n_square, 1, 2))
+    unit = np.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype=np.float64)
+    corners = low + unit * (high - low) + rng.uniform(-0.1, 0.1, size=(n_square, 4, 2)) * (high - low)
+    position = (np.linspace(0, 4, n_points, endpoint=False) + rng.uniform(0, 4, size=(n_square, 1))) % 4
+    side = position.astype(np.intp)
+    fraction = (position - side)[..., None]
+    square_idxs = np.arange(n_square)[:, None]
+    start = corners[square_idxs, side]
+    end = corners[square_idxs, (side + 1) % 4]
+    points[labels == 1] = start + fraction * (end - start)
+
+    points += rng.normal(0, 1, size=points.shape)
+    return np.round(points).astype(np.int32), labels
+
+
+def time_stage(fn, repeat: int):
+    """Return the result of fn and the best wall time in seconds over repeat runs."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def peak_memory(fn) -> int:
+    """Return the peak memory in bytes allocated by Python and NumPy while running fn."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(n_samples: int, n_points: int, n_emission: int, n_predict: int, repeat: int, seed: int = 0,
+                  backend: str = "auto"):
+    """
+    Time every stage of the HMM pipeline on a synthetic dataset.
+
+    Args:
+        n_samples (int): Number of samples in the dataset.
+        n_points (int): Number of contour points per sample (sequence length).
+        n_emission (int): Number of emissions.
+        n_predict (int): Number of samples classified one by one with HMM.predict.
+        repeat (int): Number of timed runs per stage, the best one is reported.
+        seed (int, optional): Random seed of the dataset. Defaults to 0.
+        backend (str, optional): Kernel backend of the HMM, "auto", "numpy" or "numba". Defaults to "auto".
+
+    Returns:
+        dict: Sizes, accuracy and per-stage seconds, samples/sec and peak memory.
+    """
+    points, labels = make_synthetic_points(n_samples, n_points, seed=seed)
+    pp = utils.Preprocess(n_emission=n_emission)
+    features = pp.extract_observations_batch(points)
+    observations = pp.quantize_observation(features)
+    samples = [{"observations": sample_observations, "label": label} for sample_observations, label in zip(observations, labels)]
+    hmm_obj = HMM(n_state=2, n_emission=n_emission, backend=backend)
+    hmm_obj.fit(samples)
+    unlabeled_samples = [{"observations": sample_observations} for sample_observations in observations]
+    n_predict = min(n_predict, n_samples)
+
+    stages = {
+        "extract": (lambda: pp.extract_observations_batch(points), n_samples),
+        "quantize": (lambda: pp.quantize_observation(features), n_samples),
+        "fit": (lambda: hmm_obj.fit(samples), n_samples),
+        #? A fixed number of Baum-Welch iterations, tol=-inf never stops early
+        "fit_em": (lambda: HMM(n_state=2, n_emission=n_emission, backend=backend).fit_em(
+            unlabeled_samples, n_iter=5, tol=-np.inf, random_state=seed), n_samples),
+        "predict": (lambda: [hmm_obj.predict(sample["observations"]) for sample in samples[:n_predict]], n_predict),
+        "predict_batch": (lambda: hmm_obj.predict_batch(observations), n_samples),
+    }
+
+    results = {"n_samples": n_samples, "n_points": n_points, "n_emission": n_emission, "backend": hmm_obj.backend,
+               "stages": {}}
+    for name, (fn, n_stage_samples) in stages.items():
+        output, seconds = time_stage(fn, repeat)
+        results["stages"][name] = {
+            "seconds": seconds,
+            "samples_per_sec": n_stage_samples / seconds if seconds > 0 else float("inf"),
+            "peak_memory_bytes": peak_memory(fn),
+        }
+        if name == "predict_batch":
+            results["accuracy"] = float((output[0] == labels).mean())
+    return results
+
+
+def environment_info() -> dict:
+    """Return the commit, library versions and machine of the benchmark run."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "numba": kernels.numba.__version__ if kernels.NUMBA_AVAILABLE else None,
+        "machine": platform.machine(),
+        "argv": sys.argv[1:],
+    }
+
+
+def compare_reports(baseline: dict, report: dict):
+    """Print the speedup of every stage of report relative to a baseline report with the same sizes."""
+    baseline_results = {(results["n_samples"], results["n_points"], results["n_emission"]): results
+                        for results in baseline["results"]}
+    print(f"Speedup relative to commit {baseline['environment']['commit']}")
+    for results in report["results"]:
+        key = (results["n_samples"], results["n_points"], results["n_emission"])
+        if key not in baseline_results:
+            continue
+        print(f"n_samples={key[0]} n_points={key[1]}")
+        for name, stage in results["stages"].items():
+            baseline_stage = baseline_results[key]["stages"].get(name)
+            if baseline_stage is not None:
+                print(f"  {name:<14} x{baseline_stage['seconds'] / stage['seconds']:.2f}")
+
+
+def main(args):
+    report = {"environment": environment_info(), "results": []}
+    for n_samples in args.sizes:
+        for n_points in args.lengths:
+            results = run_benchmark(n_samples=n_samples, n_points=n_points, n_emission=args.n_emission,
+                                    n_predict=args.n_predict, repeat=args.repeat, seed=args.seed,
+                                    backend=args.backend)
+            report["results"].append(results)
+            print(f"n_samples={n_samples} n_points={n_points} backend={results['backend']} accuracy={results['accuracy']:.3f}")
+            for name, stage in results["stages"].items():
+                print(f"  {name:<14} {stage['seconds'] * 1000:10.2f} ms {stage['samples_per_sec']:14.0f} samples/s "
+                      f"{stage['peak_memory_bytes'] / 2**20:10.2f} MiB")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare_reports(json.load(f), report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='number of samples of each synthetic dataset')
+    parser.add_argument('--lengths', type=int, nargs='+', default=[8, 64], help='number of contour points per sample')
+    parser.add_argument('--n-emission', type=int, default=10, help='number of emissions')
+    parser.add_argument('--n-predict', type=int, default=1000, help='number of samples classified one by one with predict')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage, the best one is reported')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic datasets')
+    parser.add_argument('--backend', type=str, default='auto', choices=kernels.BACKENDS, help='kernel backend of the HMM')
+    parser.add_argument('-o', '--output', type=str, default='benchmark.json', help='JSON results path')
+    parser.add_argument('--compare', type=str, default=None, help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,231 @@
+import numpy as np
+from typing import Iterator, List
+
+SAMPLING_METHODS = ("index", "arc_length")
+
+
+def contour_offsets_from_lengths(lengths) -> np.ndarray:
+    """Return the offsets (n_contour + 1,) of contours with the given number of points."""
+    return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+
+def resample_contours(contour_points: np.ndarray, contour_offsets: np.ndarray, n_observations: int,
+                      method: str = "index") -> np.ndarray:
+    """
+    Select n_observations points of every contour of a ragged array, without a Python loop over contours.
+
+    "index" keeps the points at indexes int(k * n_points / n_observations), exactly like np.linspace in get_sample.
+    "arc_length" places the points at equal distances along the closed contour, interpolating between contour
+    pixels, and rounds them to the pixel grid like OpenCV contours.
+
+    Args:
+        contour_points (np.ndarray): Concatenated contour points (n_points_total, 2).
+        contour_offsets (np.ndarray): Start of every contour, with the total number of points appended.
+        n_observations (int): Number of points to keep per contour.
+        method (str, optional): "index" or "arc_length". Defaults to "index".
+
+    Returns:
+        np.ndarray: Selected points (n_contour, n_observations, 2) as int32.
+    """
+    contour_points = np.asarray(contour_points)
+    contour_offsets = np.asarray(contour_offsets, dtype=np.int64)
+    starts = contour_offsets[:-1]
+    lengths = np.diff(contour_offsets)
+    if len(lengths) and lengths.min() == 0:
+        raise ValueError("Every contour must have at least one point")
+
+    if method == "index":
+        #? Same floating point operations as np.linspace(0, n_points, n_observations + 1)[:-1], then truncation
+        step = lengths[:, None] / n_observations
+        point_idxs = (np.arange(n_observations)[None] * step).astype(np.int64)
+        return contour_points[starts[:, None] + point_idxs].astype(np.int32)
+
+    if method != "arc_length":
+        raise ValueError(f"Unknown sampling method {method}, expected one of {SAMPLING_METHODS}")
+
+    #? Segment i goes from point i to the next point of the same contour, the last point closes the contour
+    points = contour_points.astype(np.float64)
+    next_idxs = np.arange(1, len(points) + 1)
+    next_idxs[contour_offsets[1:] - 1] = starts
+    segment_lengths = np.linalg.norm(points[next_idxs] - points, axis=1)
+
+    #? Cumulative distance at the start of every segment, restarting from 0 for every contour
+    cumulative = np.concatenate([[0.0], np.cumsum(segment_lengths)])
+    perimeters = cumulative[contour_offsets[1:]] - cumulative[starts]
+    targets = cumulative[starts][:, None] + perimeters[:, None] * (np.arange(n_observations)[None] / n_observations)
+
+    #? Segment holding every target, clipped to its contour against rounding at the contour boundaries
+    segment_idxs = np.searchsorted(cumulative[:-1], targets, side="right") - 1
+    segment_idxs = np.clip(segment_idxs, starts[:, None], contour_offsets[1:, None] - 1)
+    segment_lengths = segment_lengths[segment_idxs]
+    fraction = np.divide(targets - cumulative[segment_idxs], segment_lengths,
+                         out=np.zeros_like(targets), where=segment_lengths > 0)
+    fraction = np.clip(fraction, 0.0, 1.0)[..., None]
+    start_points = points[segment_idxs]
+    resampled = start_points + fraction * (points[next_idxs[segment_idxs]] - start_points)
+    return np.round(resampled).astype(np.int32)
+
+
+class ContourStore:
+    """
+    Full contours of a dataset part, stored once as a ragged concatenated array.
+
+    Contour i is contour_points[contour_offsets[i]:contour_offsets[i + 1]], so any number of observations can be
+    resampled from the store without decoding the images again.
+
+    Attributes:
+        contour_points (np.ndarray): Concatenated contour points (n_points_total, 2) as int32.
+        contour_offsets (np.ndarray): Start of every contour, with the total number of points appended.
+        labels (np.ndarray): Class id of every contour.
+        contour_method (str): Contour extractor used to build the store.
+
+    Methods:
+        __init__(contour_points, contour_offsets, labels, contour_method): Initialize the store.
+        from_contours(contours, labels, contour_method): Build a store from a list of contours.
+        __len__(): Return the number of contours.
+        contour(idx): Return the points of one contour.
+        resample(n_observations, method): Select n_observations points of every contour.
+        iter_resample(n_observations, method, batch_size): Resample the contours batch by batch.
+        save(path): Save the store to an .npz file.
+        load(path): Load a store from an .npz file.
+    """
+    def __init__(self, contour_points: np.ndarray, contour_offsets: np.ndarray, labels: np.ndarray,
+                 contour_method: str = "canny") -> None:
+        """Initialize the store."""
+        self.contour_points = np.asarray(contour_points, dtype=np.int32).reshape(-1, 2)
+        self.contour_offsets = np.asarray(contour_offsets, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.contour_method = contour_method
+        if len(self.contour_offsets) != len(self.labels) + 1 or self.contour_offsets[-1] != len(self.contour_points):
+            raise ValueError("Contour offsets do not match the number of labels and points")
+
+    @classmethod
+    def from_contours(cls, contours: List[np.ndarray], labels, contour_method: str = "canny") -> "ContourStore":
+        """
+        Build a store from a list of contours.
+
+        Args:
+            contours (list): Contour points (n_points, 2) of every sample.
+            labels (list): Class id of every sample.
+            contour_method (str, optional): Contour extractor used. Defaults to "canny".
+
+        Returns:
+            ContourStore: The store.
+        """
+        contour_offsets = contour_offsets_from_lengths([len(contour_points) for contour_points in contours])
+        contour_points = np.concatenate(contours) if contours else np.zeros((0, 2), dtype=np.int32)
+        return cls(contour_points, contour_offsets, labels, contour_method=contour_method)
+
+    def __len__(self) -> int:
+        """Return the number of contours."""
+        return len(self.labels)
+
+    def contour(self, idx: int) -> np.ndarray:
+        """Return the points (n_points, 2) of contour idx."""
+        return self.contour_points[self.contour_offsets[idx]:self.contour_offsets[idx + 1]]
+
+    def resample(self, n_observations: int, method: str = "index") -> np.ndarray:
+        """
+        Select n_observations points of every contour, see resample_contours.
+
+        Args:
+            n_observations (int): Number of points to keep per contour.
+            method (str, optional): "index" or "arc_length". Defaults to "index".
+
+        Returns:
+            np.ndarray: Selected points (n_contour, n_observations, 2) as int32.
+        """
+        return resample_contours(self.contour_points, self.contour_offsets, n_observations, method=method)
+
+    def iter_resample(self, n_observations: int, method: str = "index", batch_size: int = 65536) -> Iterator:
+        """
+        Resample the contours batch by batch, so the selected points of the whole store are never held at once.
+
+        Args:
+            n_observations (int): Number of points to keep per contour.
+            method (str, optional): "index" or "arc_length". Defaults to "index".
+            batch_size (int, optional): Maximum number of contours per batch. Defaults to 65536.
+
+        Yields:
+            tuple: Selected points (n_contour, n_observations, 2) and labels (n_contour,) of each batch.
+        """
+        for batch_start in range(0, len(self), batch_size):
+            offsets = self.contour_offsets[batch_start:batch_start + batch_size + 1]
+            points = resample_contours(self.contour_points[offsets[0]:offsets[-1]], offsets - offsets[0],
+                                       n_observations, method=method)
+            yield points, self.labels[batch_start:batch_start + batch_size]
+
+    def save(self, path: str):
+        """Save the store to an uncompressed .npz file."""
+        np.savez(path,
+                 contour_points=self.contour_points,
+                 contour_offsets=self.contour_offsets,
+                 labels=self.labels,
+                 contour_method=np.asarray(self.contour_method),
+                 )
+
+    @classmethod
+    def load(cls, path: str) -> "ContourStore":
+        """Load a store saved with save."""
+        with np.load(path) as data:
+            return cls(data["contour_points"], data["contour_offsets"], data["labels"],
+                       contour_method=str(data["contour_method"]))
+
+
+class ContourStoreBuilder:
+    """
+    Growable ragged buffers of a ContourStore, filled one contour at a time.
+
+    Points and offsets are appended to preallocated arrays that double when full, so building a store never
+    holds a Python list of every contour.
+
+    Attributes:
+        contour_method (str): Contour extractor used to build the store.
+        n_contours (int): Number of appended contours.
+        n_points (int): Number of appended points.
+
+    Methods:
+        __init__(contour_method, points_capacity, contours_capacity): Allocate the buffers.
+        append(contour_points): Append the points of one contour.
+        build(labels): Return the store of the appended contours.
+    """
+    def __init__(self, contour_method: str = "canny", points_capacity: int = 1 << 16, contours_capacity: int = 1 << 10) -> None:
+        """Allocate the buffers."""
+        self.contour_method = contour_method
+        self.n_contours = 0
+        self.n_points = 0
+        self._points = np.empty((max(points_capacity, 1), 2), dtype=np.int32)
+        self._offsets = np.zeros(max(contours_capacity, 1) + 1, dtype=np.int64)
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int) -> np.ndarray:
+        """Return array with room for at least size rows, doubling its capacity."""
+        if size <= len(array):
+            return array
+        grown = np.empty((max(size, 2 * len(array)),) + array.shape[1:], dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def append(self, contour_points: np.ndarray):
+        """Append the points (n_points, 2) of one contour."""
+        n_points = self.n_points + len(contour_points)
+        self._points = self._grow(self._points, n_points)
+        self._offsets = self._grow(self._offsets, self.n_contours + 2)
+        self._points[self.n_points:n_points] = contour_points
+        self.n_points = n_points
+        self.n_contours += 1
+        self._offsets[self.n_contours] = n_points
+
+    def build(self, labels) -> ContourStore:
+        """
+        Return the store of the appended contours, copied out of the growable buffers.
+
+        Args:
+            labels (np.ndarray): Class id of every appended contour.
+
+        Returns:
+            ContourStore: The store.
+        """
+        #? Copies, so the store owns compact arrays and the builder can keep appending
+        return ContourStore(self._points[:self.n_points].copy(), self._offsets[:self.n_contours + 1].copy(), labels,
+                            contour_method=self.contour_method)
@@ -6,30 +6,124 @@ import yaml
 import argparse
 from rich import print
 import utils
+from dataset import ShardWriter
+from contour_store import ContourStoreBuilder, resample_contours
 import tqdm
+from typing import Iterator, List, Union
 
-def get_sample(img_path: str, n_observations: int=8, label=-1):
-    img = cv2.imread(img_path)  # Read image
+def extract_contour(gray: np.ndarray, contour_method: str="canny"):
+    """
+    Find the first contour of a grayscale image.
 
-    gray = cv2.cvtColor(img.copy(), cv2.COLOR_BGR2GRAY) # Convert to grayscale
+    Args:
+        gray (np.ndarray): Grayscale image.
+        contour_method (str, optional): "canny" to find edges with the Canny filter, or "binary" for renders of a
+            single shape on a white background, where the shape mask is used directly. Defaults to "canny".
 
-    # Setting parameter values
-    t_lower = 10  # Lower Threshold
-    t_upper = 250  # Upper threshold
+    Returns:
+        np.ndarray: All contour points (n_points, 2), or None if no contour was found.
+    """
+    if contour_method == "binary":
+        # Every non-white pixel belongs to the shape, its outer border is the contour
+        edge = (gray < 255).astype(np.uint8)
+        contours = cv2.findContours(edge, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    elif contour_method == "canny":
+        # Setting parameter values
+        t_lower = 10  # Lower Threshold
+        t_upper = 250  # Upper threshold
 
-    # Applying the Canny Edge filter
-    edge = cv2.Canny(gray, t_lower, t_upper)
+        # Applying the Canny Edge filter
+        edge = cv2.Canny(gray, t_lower, t_upper)
 
-    # Find contours for each sample
-    contours = cv2.findContours(edge, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-    try:
-        if contours:
-            contour_points = contours[0][0].reshape(-1,2)
-            # Get index of n = n_observations points from all countour points
-            point_idxs = np.linspace(0, contour_points.shape[0], n_observations+1)[:-1]
-            point_idxs = list(map(int, point_idxs))
-            selected_contour_points = contour_points[point_idxs]
-    except:
+        # Find contours for each sample
+        contours = cv2.findContours(edge, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
+    else:
+        raise ValueError(f"Unknown contour method {contour_method}, expected 'canny' or 'binary'")
+
+    if not contours[0]:
+        return None
+    return contours[0][0].reshape(-1,2)
+
+
+def select_contour_points(contour_points: np.ndarray, n_observations: int=8, sampling: str="index"):
+    """
+    Select n_observations almost equally spaced points of a contour.
+
+    Args:
+        contour_points (np.ndarray): All contour points (n_points, 2).
+        n_observations (int, optional): Number of contour points to keep. Defaults to 8.
+        sampling (str, optional): "index" for equally spaced contour indexes, or "arc_length" for equal
+            distances along the contour. Defaults to "index".
+
+    Returns:
+        np.ndarray: Selected contour points (n_observations, 2).
+    """
+    return resample_contours(contour_points, [0, len(contour_points)], n_observations, method=sampling)[0]
+
+
+def extract_contour_points(gray: np.ndarray, n_observations: int=8, contour_method: str="canny", sampling: str="index"):
+    """
+    Select n_observations almost equally spaced points on the first contour of a grayscale image.
+
+    Args:
+        gray (np.ndarray): Grayscale image.
+        n_observations (int, optional): Number of contour points to keep. Defaults to 8.
+        contour_method (str, optional): Contour extractor, "canny" or "binary". Defaults to "canny".
+        sampling (str, optional): Point sampling, "index" or "arc_length". Defaults to "index".
+
+    Returns:
+        np.ndarray: Selected contour points (n_observations, 2), or None if no contour was found.
+    """
+    contour_points = extract_contour(gray, contour_method=contour_method)
+    if contour_points is None or len(contour_points) == 0:
+        return None
+    return select_contour_points(contour_points, n_observations=n_observations, sampling=sampling)
+
+
+def read_gray(img_path: Union[str, os.PathLike, np.ndarray]):
+    """
+    Read an image file or convert an in-memory image to grayscale.
+
+    Args:
+        img_path (str or np.ndarray): Path to an image, or an image array (BGR or grayscale).
+
+    Returns:
+        np.ndarray: Grayscale image, or None if the image could not be read.
+    """
+    if isinstance(img_path, np.ndarray):
+        img = img_path
+    else:
+        img = cv2.imread(str(img_path))  # Read image
+    if img is None:
+        return None
+
+    if img.ndim == 2:
+        return img
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) # Convert to grayscale
+
+
+def get_sample(img_path: Union[str, os.PathLike, np.ndarray], n_observations: int=8, label=-1, contour_method: str="canny",
+               sampling: str="index"):
+    """
+    Extract a sample from an image file or an in-memory image.
+
+    Args:
+        img_path (str or np.ndarray): Path to an image, or an image array (BGR or grayscale) such as a camera frame.
+        n_observations (int, optional): Number of contour points to keep. Defaults to 8.
+        label (int, optional): Label of the sample. Defaults to -1.
+        contour_method (str, optional): Contour extractor, "canny" or "binary". Defaults to "canny".
+        sampling (str, optional): Point sampling, "index" or "arc_length". Defaults to "index".
+
+    Returns:
+        tuple: A tuple containing the status and the sample with "points" and "label".
+    """
+    gray = read_gray(img_path)
+    if gray is None:
+        return False, None
+
+    selected_contour_points = extract_contour_points(gray, n_observations=n_observations, contour_method=contour_method,
+                                                     sampling=sampling)
+    if selected_contour_points is None:
         return False, None
 
     # #? To visualize points on sample
@@ -49,21 +143,176 @@ def get_sample(img_path: str, n_observations: int=8, label=-1):
 
 
 
+def iter_samples(frames, n_observations: int=8, contour_method: str="canny", sampling: str="index") -> Iterator:
+    """
+    Extract samples from a stream of frames without going through the disk.
+
+    Args:
+        frames: Iterable of image arrays or paths, or an object with a cv2.VideoCapture-like read() method.
+        n_observations (int, optional): Number of contour points to keep. Defaults to 8.
+        contour_method (str, optional): Contour extractor, "canny" or "binary". Defaults to "canny".
+        sampling (str, optional): Point sampling, "index" or "arc_length". Defaults to "index".
+
+    Yields:
+        tuple: A tuple containing the status and the sample of each frame, as returned by get_sample.
+    """
+    if hasattr(frames, "read"):
+        def read_frames():
+            while True:
+                grabbed, frame = frames.read()
+                if not grabbed:
+                    return
+                yield frame
+        frames = read_frames()
+
+    for frame in frames:
+        yield get_sample(frame, n_observations=n_observations, contour_method=contour_method, sampling=sampling)
+
+
+
+def process_contour_chunk(img_paths: List[str], contour_method: str = "canny"):
+    """
+    Extract the full first contour of a chunk of images, recording failures instead of dropping them.
+
+    Args:
+        img_paths (list): Paths of the images in the chunk.
+        contour_method (str, optional): Contour extractor, "canny" or "binary". Defaults to "canny".
+
+    Returns:
+        list: One (contour_points, error) tuple per image, contour_points is None when the image failed.
+    """
+    results = []
+    for img_path in img_paths:
+        gray = read_gray(img_path)
+        if gray is None:
+            results.append((None, "unreadable image"))
+            continue
+        try:
+            contour_points = extract_contour(gray, contour_method=contour_method)
+        except cv2.error as e:
+            results.append((None, f"cv2.error: {e}"))
+            continue
+        if contour_points is None or len(contour_points) == 0:
+            results.append((None, "no contour found"))
+        else:
+            results.append((contour_points.astype(np.int32), None))
+    return results
+
+
+def list_images(dataset_dir: str, part: str, classes: List[str]):
+    """
+    List the images of a dataset part, sorted by class and file name.
+
+    Args:
+        dataset_dir (str): Dataset directory with one {part}/{class_name}/*.png folder per class.
+        part (str): Dataset part, "train" or "test".
+        classes (list): Class names, the class id is the index in this list.
+
+    Returns:
+        tuple: Image paths and the class id of each image.
+    """
+    img_path_list = []
+    label_list = []
+    for class_id, class_name in enumerate(classes):
+        class_paths = sorted(str(path) for path in pathlib.Path(dataset_dir).glob(f"{part}/{class_name}/*.png"))
+        img_path_list.extend(class_paths)
+        label_list.extend([class_id] * len(class_paths))
+    return img_path_list, label_list
+
+
+def contour_store_path(dataset_dir: str, part: str) -> str:
+    """Return the path of the full contour store of a dataset part."""
+    return os.path.join(dataset_dir, f"contours_{part}.npz")
+
+
+def build_part(img_paths: List[str], labels: List[int], n_jobs: int = 1, chunk_size: int = 64, desc: str = "",
+               contour_method: str = "canny"):
+    """
+    Extract the full contours of a dataset part over a process pool.
+
+    Images are sent to the workers in chunks and at most 2 * n_jobs chunks are in flight at a time,
+    contours are appended to the store buffers in image order as their chunk is collected.
+
+    Args:
+        img_paths (list): Paths of the images of the part.
+        labels (list): Class id of each image.
+        n_jobs (int, optional): Number of worker processes. Defaults to 1.
+        chunk_size (int, optional): Number of images per task. Defaults to 64.
+        desc (str, optional): Progress bar description. Defaults to "".
+        contour_method (str, optional): Contour extractor, "canny" or "binary". Defaults to "canny".
+
+    Returns:
+        tuple: ContourStore of the images with a contour and a list of (img_path, error) failures.
+    """
+    n_images = len(img_paths)
+    builder = ContourStoreBuilder(contour_method=contour_method)
+    succeeded = np.zeros(n_images, dtype=bool)
+    failed = []
+
+    tasks = ((chunk_start, (img_paths[chunk_start:chunk_start + chunk_size], contour_method))
+             for chunk_start in range(0, n_images, chunk_size))
+    progress = tqdm.tqdm(total=n_images, desc=desc)
+    with utils.process_pool(n_jobs) as executor:
+        #? Chunks come back in image order, so every contour is appended to the ragged buffers as soon as it arrives
+        for chunk_start, chunk_results in utils.bounded_map(executor, process_contour_chunk, tasks,
+                                                            max_in_flight=2 * n_jobs, ordered=True):
+            for offset, (contour_points, error) in enumerate(chunk_results):
+                img_idx = chunk_start + offset
+                if contour_points is None:
+                    failed.append((img_paths[img_idx], error))
+                else:
+                    builder.append(contour_points)
+                    succeeded[img_idx] = True
+            progress.update(len(chunk_results))
+    progress.close()
+
+    store = builder.build(np.asarray(labels, dtype=np.int64)[succeeded])
+    return store, failed
+
+
 def main(args):
     with open(args.cfg, "r") as f:
         config_data = yaml.load(f, Loader=yaml.FullLoader)
     config = utils.Config(**config_data)
 
-    points = {"train": [], "test": []}
-    labels = {"train": [], "test": []}
-    for class_id, class_name in enumerate(["circle", "square"]):
-        for part in ["train", "test"]:
-            img_path_list = [str(path) for path in pathlib.Path(config.dataset_dir).glob(f"{part}/{class_name}/*.png")]  
-            for img_path in tqdm.tqdm(img_path_list, desc=f"{class_name} {part} part: "):
-                status, sample = get_sample(img_path=img_path, n_observations=config.n_observations)
-                if status:
-                    points[part].append(sample["points"])
-                    labels[part].append(class_id)
+    sampling = getattr(config, "sampling", "index")
+    write_shards = getattr(config, "dataset_format", "npz") == "shards"
+    if write_shards:
+        pp = utils.Preprocess(n_emission=config.n_emission)
+        writer = ShardWriter(os.path.join(config.dataset_dir, "shards"),
+                             n_observations=config.n_observations,
+                             n_emission=config.n_emission,
+                             shard_size=config.shard_size)
+
+    points = {}
+    labels = {}
+    failed = {}
+    for part in ["train", "test"]:
+        img_path_list, label_list = list_images(config.dataset_dir, part, config.classes)
+
+        store, failed[part] = build_part(img_path_list, label_list,
+                                         n_jobs=config.n_jobs,
+                                         chunk_size=config.chunk_size,
+                                         desc=f"{part} part: ",
+                                         contour_method=getattr(config, "contour_method", "canny"))
+        for img_path, error in failed[part]:
+            print(f"[red]Failed[/red] {img_path}: {error}")
+
+        #? Keep the full contours, so another n_observations or sampling only needs a resample of the store
+        store.save(contour_store_path(config.dataset_dir, part))
+        if write_shards:
+            #? One shard worth of samples is resampled and quantized at a time and written as soon as it is full
+            for part_points, part_labels in store.iter_resample(config.n_observations, method=sampling,
+                                                                batch_size=config.shard_size):
+                observations = pp.quantize_observation(pp.extract_observations_batch(part_points))
+                writer.add(part, part_points, part_labels, observations)
+        else:
+            points[part] = store.resample(config.n_observations, method=sampling)
+            labels[part] = store.labels
+
+    if write_shards:
+        writer.close()
+        return
 
     data_path = os.path.join(config.dataset_dir, "data.npz")
     np.savez(data_path, 
@@ -71,6 +320,8 @@ def main(args):
              points_test=points["test"], 
              labels_train=labels["train"],
              labels_test=labels["test"],
+             failed_train=np.asarray([img_path for img_path, _ in failed["train"]], dtype=str),
+             failed_test=np.asarray([img_path for img_path, _ in failed["test"]], dtype=str),
              )
 
 
@@ -1,92 +1,192 @@
 import os
 import random
+import numpy as np
+import cv2
 from PIL import Image, ImageDraw
 import yaml
 import argparse
 from rich import print
-from typing import Dict
+from typing import Dict, List
 import tqdm
+import utils
+import create_dataset
+from dataset import ShardWriter
+
+
+def sample_rng(seed: int, part: str, shape: str, idx: int) -> random.Random:
+    """
+    Create the random generator of a single sample.
+
+    The seed only depends on the sample itself, so the output is the same for any number of workers.
+
+    Args:
+        seed (int): Base seed of the dataset.
+        part (str): Dataset part, "train" or "test".
+        shape (str): Shape name, "circle" or "square".
+        idx (int): Index of the sample in its part and shape.
+
+    Returns:
+        random.Random: Random generator of the sample.
+    """
+    return random.Random(f"{seed}/{part}/{shape}/{idx}")
+
+
+def render_square(imgsz: int, rng: random.Random) -> Image.Image:
+    # Create a new blank image for each iteration
+    img = Image.new('RGB', (imgsz, imgsz), color='white')
+
+    # Define random non-ideal square coordinates with random 10% shift in width and height for each corner
+    x1 = rng.randint(0, imgsz // 3)
+    y1 = rng.randint(0, imgsz // 3)
+    x3 = rng.randint(imgsz - imgsz // 3, imgsz)
+    y3 = rng.randint(imgsz - imgsz // 3, imgsz)
+    x2 = x3
+    y2 = y1
+    x4 = x1
+    y4 = y3
+
+    width_shift = int(0.1 * (x2 - x1))
+    height_shift = int(0.1 * (y2 - y1))
+
+    square_coords = [
+        (x1 + rng.randint(-width_shift, width_shift), y1 + rng.randint(-height_shift, height_shift)),
+        (x2 + rng.randint(-width_shift, width_shift), y2 + rng.randint(-height_shift, height_shift)),
+        (x3 + rng.randint(-width_shift, width_shift), y3 + rng.randint(-height_shift, height_shift)),
+        (x4 + rng.randint(-width_shift, width_shift), y4 + rng.randint(-height_shift, height_shift))
+    ]
+
+    square_coords_valid = []
+    for (x, y) in square_coords:
+        if x < 0: x = 10
+        if x > imgsz: x = imgsz - 10
+        if y < 0: y = 10
+        if y > imgsz: y = imgsz - 10
+        square_coords_valid.append((x, y))
+
+    # Define random color for both outline and fill
+    color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+
+    # Draw the square onto the image, with the same color for outline and fill
+    draw = ImageDraw.Draw(img)
+    draw.polygon(square_coords, outline=color, fill=color)
+    return img
+
+
+def render_circle(imgsz: int, rng: random.Random) -> Image.Image:
+    # Create a new blank image for each iteration
+    img = Image.new('RGB', (imgsz, imgsz), color='white')
+
+    # Define random non-ideal circle coordinates with random 10% shift in radius for each corner
+    start_margin = imgsz // 8
+    end_margin = imgsz - imgsz // 8
+    x = rng.randint(start_margin, end_margin)
+    y = rng.randint(start_margin, end_margin)
+    minxy = min([x, y, imgsz-x, imgsz-y])
+    r = rng.randint(minxy // 10, minxy - minxy // 10)
+    r_shift = int(0.1 * r)
+
+    circle_coords = (x, y, r + rng.randint(-r_shift, r_shift))
+
+    # Define random color for both outline and fill
+    color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+
+    # Draw the circle onto the image, with the same color for outline and fill
+    draw = ImageDraw.Draw(img)
+    draw.ellipse((circle_coords[0] - circle_coords[2], circle_coords[1] - circle_coords[2],
+                circle_coords[0] + circle_coords[2], circle_coords[1] + circle_coords[2]),
+                outline=color, fill=color)
+    return img
+
+
+RENDERERS = {"circle": render_circle, "square": render_square}
+
+
+def render_chunk(config: Dict, part: str, shape: str, idxs: List[int], write_png: bool = True):
+    """
+    Render a chunk of samples of one shape, either saving PNG files or extracting contour points in memory.
+
+    Args:
+        config (dict): Configuration with "dataset_dir", "imgsz", "seed" and "n_observations".
+        part (str): Dataset part, "train" or "test".
+        shape (str): Shape name, "circle" or "square".
+        idxs (list): Indexes of the samples to render.
+        write_png (bool, optional): Save PNG files if True, otherwise return contour points. Defaults to True.
+
+    Returns:
+        tuple: Contour points (n_sample, n_observations, 2) of the samples with a contour and the number of
+            samples dropped without one, or None when PNG files are written.
+    """
+    shape_dir = os.path.join(config["dataset_dir"], part, shape)
+    points = []
+    for i in idxs:
+        img = RENDERERS[shape](config["imgsz"], sample_rng(config.get("seed", 0), part, shape, i))
+        if write_png:
+            # Save the image with a unique filename
+            img.save(os.path.join(shape_dir, f"non_ideal_{shape}_{i}.png"))
+            continue
+
+        gray = cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2GRAY)
+        sample_points = create_dataset.extract_contour_points(gray, n_observations=config["n_observations"],
+                                                              contour_method=config.get("contour_method", "canny"),
+                                                              sampling=config.get("sampling", "index"))
+        if sample_points is not None:
+            points.append(sample_points)
+
+    if write_png:
+        return None
+    return np.asarray(points, dtype=np.int32).reshape(-1, config["n_observations"], 2), len(idxs) - len(points)
+
+
+def create_shapes(config: Dict, part: str, shape: str, write_png: bool = True, writer: ShardWriter = None, label: int = -1):
+    """
+    Render all samples of a shape in a dataset part, with the sample indexes partitioned across worker processes.
+
+    Args:
+        config (dict): Configuration dictionary.
+        part (str): Dataset part, "train" or "test".
+        shape (str): Shape name, "circle" or "square".
+        write_png (bool, optional): Save PNG files if True, otherwise stream contour points to writer. Defaults to True.
+        writer (ShardWriter, optional): Dataset writer receiving the contour points when write_png is False.
+        label (int, optional): Class id of the shape written with the contour points. Defaults to -1.
+
+    Returns:
+        int: Number of samples dropped because no contour was found, always 0 when write_png is True.
+    """
+    if write_png:
+        os.makedirs(os.path.join(config["dataset_dir"], part, shape), exist_ok=True)
+    pp = utils.Preprocess(n_emission=config["n_emission"])
+
+    n_samples = config[f"n_{part}_samples_per_class"]
+    n_jobs = config.get("n_jobs", 1)
+    chunk_size = config.get("chunk_size", 64)
+    tasks = ((chunk_start, (config, part, shape, range(chunk_start, min(chunk_start + chunk_size, n_samples)), write_png))
+             for chunk_start in range(0, n_samples, chunk_size))
+
+    #? Chunks are written in index order so the dataset does not depend on n_jobs
+    n_dropped = 0
+    progress = tqdm.tqdm(total=n_samples, desc=f"Create {shape} {part} part:")
+    with utils.process_pool(n_jobs) as executor:
+        for chunk_start, result in utils.bounded_map(executor, render_chunk, tasks, max_in_flight=2 * n_jobs, ordered=True):
+            progress.update(min(chunk_size, n_samples - chunk_start))
+            if write_png:
+                continue
+            points, n_chunk_dropped = result
+            n_dropped += n_chunk_dropped
+            if len(points):
+                observations = pp.quantize_observation(pp.extract_observations_batch(points))
+                writer.add(part, points, np.full(len(points), label, dtype=np.int64), observations)
+    progress.close()
+    if n_dropped:
+        print(f"[yellow]Dropped[/yellow] {n_dropped} of {n_samples} {shape} {part} samples without a contour")
+    return n_dropped
 
 
 def create_square(config: Dict, part: str):
-    square_dir = os.path.join(config["dataset_dir"], part, "square")
-    os.makedirs(square_dir, exist_ok=True)
-
-    for i in tqdm.tqdm(range(config[f"n_{part}_samples_per_class"]), desc=f"Create square {part} part:"):
-        # Create a new blank image for each iteration
-        img = Image.new('RGB', (config["imgsz"], config["imgsz"]), color='white')
-
-        # Define random non-ideal square coordinates with random 10% shift in width and height for each corner
-        x1 = random.randint(0, config["imgsz"] // 3)
-        y1 = random.randint(0, config["imgsz"] // 3)
-        x3 = random.randint(config["imgsz"] - config["imgsz"] // 3, config["imgsz"])
-        y3 = random.randint(config["imgsz"] - config["imgsz"] // 3, config["imgsz"])
-        x2 = x3
-        y2 = y1
-        x4 = x1
-        y4 = y3
-
-        width_shift = int(0.1 * (x2 - x1))
-        height_shift = int(0.1 * (y2 - y1))
-
-        square_coords = [
-            (x1 + random.randint(-width_shift, width_shift), y1 + random.randint(-height_shift, height_shift)),
-            (x2 + random.randint(-width_shift, width_shift), y2 + random.randint(-height_shift, height_shift)),
-            (x3 + random.randint(-width_shift, width_shift), y3 + random.randint(-height_shift, height_shift)),
-            (x4 + random.randint(-width_shift, width_shift), y4 + random.randint(-height_shift, height_shift))
-        ]
-
-        square_coords_valid = []
-        for (x, y) in square_coords:
-            if x < 0: x = 10
-            if x > config["imgsz"]: x = config["imgsz"] - 10
-            if y < 0: y = 10
-            if y > config["imgsz"]: y = config["imgsz"] - 10
-            square_coords_valid.append((x, y))
-
-        # Define random color for both outline and fill
-        color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-
-        # Draw the square onto the image, with the same color for outline and fill
-        draw = ImageDraw.Draw(img)
-        draw.polygon(square_coords, outline=color, fill=color)
-
-        # Save the image with a unique filename
-        img.save(os.path.join(square_dir, f"non_ideal_square_{i}.png"))
-
+    create_shapes(config=config, part=part, shape="square")
 
 
 def create_cirlce(config: Dict, part: str):
-    circle_dir = os.path.join(config["dataset_dir"], part, "circle")
-    os.makedirs(circle_dir, exist_ok=True)
-
-    for i in tqdm.tqdm(range(config[f"n_{part}_samples_per_class"]), desc=f"Create circle {part} part:"):
-        # Create a new blank image for each iteration
-        img = Image.new('RGB', (config["imgsz"], config["imgsz"]), color='white')
-
-        # Define random non-ideal circle coordinates with random 10% shift in radius for each corner
-        start_margin = config["imgsz"] // 8
-        end_margin = config["imgsz"] - config["imgsz"] // 8
-        x = random.randint(start_margin, end_margin)
-        y = random.randint(start_margin, end_margin)
-        minxy = min([x, y, config["imgsz"]-x, config["imgsz"]-y])
-        # print("minxy", minxy)
-        r = random.randint(minxy // 10, minxy - minxy // 10)
-        r_shift = int(0.1 * r)
-
-        circle_coords = (x, y, r + random.randint(-r_shift, r_shift))
-
-        # Define random color for both outline and fill
-        color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-
-        # Draw the circle onto the image, with the same color for outline and fill
-        draw = ImageDraw.Draw(img)
-        draw.ellipse((circle_coords[0] - circle_coords[2], circle_coords[1] - circle_coords[2],
-                    circle_coords[0] + circle_coords[2], circle_coords[1] + circle_coords[2]),
-                    outline=color, fill=color)
-
-        # Save the image with a unique filename
-        img.save(os.path.join(circle_dir, f"non_ideal_circle_{i}.png"))
+    create_shapes(config=config, part=part, shape="circle")
 
 
 
@@ -96,6 +196,19 @@ def main(args):
     print(config)
 
     os.makedirs(config["dataset_dir"], exist_ok=True)
+
+    if args.no_png:
+        #? Skip PNG encoding and write contour points straight to the sharded dataset format
+        writer = ShardWriter(os.path.join(config["dataset_dir"], "shards"),
+                             n_observations=config["n_observations"],
+                             n_emission=config["n_emission"],
+                             shard_size=config.get("shard_size", 65536))
+        for part in ["train", "test"]:
+            for class_id, class_name in enumerate(config["classes"]):
+                create_shapes(config=config, part=part, shape=class_name, write_png=False, writer=writer, label=class_id)
+        writer.close()
+        return
+
     os.makedirs(os.path.join(config["dataset_dir"], "train"), exist_ok=True)
     os.makedirs(os.path.join(config["dataset_dir"], "test"), exist_ok=True)
 
@@ -111,5 +224,6 @@ def main(args):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--cfg', type=str, default='config.yaml', help='config.yaml path')
+    parser.add_argument('--no-png', action='store_true', help='write contour points to the sharded dataset instead of PNG images')
     args = parser.parse_args()
     main(args)
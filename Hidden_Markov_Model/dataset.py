@@ -0,0 +1,156 @@
+import os
+import json
+import numpy as np
+from typing import Dict, Iterator, List
+
+INDEX_FILE = "index.json"
+FORMAT_VERSION = 1
+FIELDS = ("points", "labels", "observations")
+
+
+def is_sharded_dataset(path: str) -> bool:
+    """Return True if path is a directory holding a sharded dataset index."""
+    return path is not None and os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+class ShardWriter:
+    """
+    Writer of the sharded dataset format.
+
+    Every part ("train", "test") is split into shards of at most shard_size samples. Each shard is a set of
+    uncompressed .npy files, one per field, so it can be opened with np.load(mmap_mode='r'). A small JSON
+    index lists the shards of every part.
+
+    Attributes:
+        root (str): Directory of the dataset.
+        n_observations (int): Number of contour points per sample.
+        n_emission (int): Number of emissions used to compute the stored observation codes.
+        shard_size (int): Maximum number of samples per shard.
+
+    Methods:
+        __init__(root, n_observations, n_emission, shard_size): Initialize the writer.
+        add(part, points, labels, observations): Append samples to a part, flushing full shards to disk.
+        close(): Flush the remaining samples and write the index file.
+    """
+    def __init__(self, root: str, n_observations: int, n_emission: int, shard_size: int = 65536) -> None:
+        """Initialize the writer."""
+        self.root = root
+        self.n_observations = n_observations
+        self.n_emission = n_emission
+        self.shard_size = shard_size
+        self._buffers: Dict[str, Dict[str, List[np.ndarray]]] = {}
+        self._shards: Dict[str, List[Dict]] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def add(self, part: str, points: np.ndarray, labels: np.ndarray, observations: np.ndarray):
+        """
+        Append samples to a part, flushing full shards to disk.
+
+        Args:
+            part (str): Name of the part, e.g. "train" or "test".
+            points (np.ndarray): Contour points with shape (n_sample, n_observations, 2).
+            labels (np.ndarray): Class ids with shape (n_sample,).
+            observations (np.ndarray): Emission codes with shape (n_sample, n_observations).
+        """
+        buffer = self._buffers.setdefault(part, {field: [] for field in FIELDS})
+        self._shards.setdefault(part, [])
+        buffer["points"].append(np.asarray(points, dtype=np.int32))
+        buffer["labels"].append(np.asarray(labels, dtype=np.int64))
+        buffer["observations"].append(np.asarray(observations))
+        while sum(len(labels) for labels in buffer["labels"]) >= self.shard_size:
+            self._flush(part, self.shard_size)
+
+    def _flush(self, part: str, n_sample: int = None):
+        """Write the first n_sample buffered samples of a part as one shard."""
+        buffer = self._buffers[part]
+        arrays = {field: np.concatenate(buffer[field]) for field in FIELDS}
+        n_sample = len(arrays["labels"]) if n_sample is None else n_sample
+        if n_sample == 0:
+            return
+
+        name = f"{part}_{len(self._shards[part]):05d}"
+        for field in FIELDS:
+            np.save(os.path.join(self.root, f"{name}_{field}.npy"), np.ascontiguousarray(arrays[field][:n_sample]))
+            buffer[field] = [arrays[field][n_sample:]]
+        self._shards[part].append({"name": name, "n_samples": int(n_sample)})
+
+    def close(self):
+        """Flush the remaining samples and write the index file."""
+        for part in self._buffers:
+            self._flush(part)
+        index = {
+            "format_version": FORMAT_VERSION,
+            "n_observations": self.n_observations,
+            "n_emission": self.n_emission,
+            "parts": {part: {"n_samples": sum(shard["n_samples"] for shard in shards), "shards": shards}
+                      for part, shards in self._shards.items()},
+        }
+        with open(os.path.join(self.root, INDEX_FILE), "w") as f:
+            json.dump(index, f, indent=2)
+
+
+class ShardedDataset:
+    """
+    Lazy, memory-mapped view of one part of a sharded dataset.
+
+    Opening the dataset only reads the index, shards are memory-mapped on first access.
+
+    Attributes:
+        root (str): Directory of the dataset.
+        part (str): Name of the part, e.g. "train" or "test".
+        n_observations (int): Number of contour points per sample.
+        n_emission (int): Number of emissions used to compute the stored observation codes.
+        shards (list): Name and number of samples of every shard.
+
+    Methods:
+        __init__(root, part): Read the index of the dataset.
+        __len__(): Return the number of samples of the part.
+        open_shard(shard_idx, field): Memory-map one field of a shard.
+        iter_batches(batch_size, fields): Iterate lazily over batches of the part.
+    """
+    def __init__(self, root: str, part: str) -> None:
+        """Read the index of the dataset."""
+        with open(os.path.join(root, INDEX_FILE), "r") as f:
+            index = json.load(f)
+        if index["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported dataset format version {index['format_version']}, expected {FORMAT_VERSION}")
+
+        self.root = root
+        self.part = part
+        self.n_observations = index["n_observations"]
+        self.n_emission = index["n_emission"]
+        self.shards = index["parts"].get(part, {"shards": []})["shards"]
+
+    def __len__(self) -> int:
+        """Return the number of samples of the part."""
+        return sum(shard["n_samples"] for shard in self.shards)
+
+    def open_shard(self, shard_idx: int, field: str) -> np.ndarray:
+        """
+        Memory-map one field of a shard.
+
+        Args:
+            shard_idx (int): Index of the shard.
+            field (str): One of "points", "labels" or "observations".
+
+        Returns:
+            np.ndarray: Read-only memory-mapped array.
+        """
+        name = self.shards[shard_idx]["name"]
+        return np.load(os.path.join(self.root, f"{name}_{field}.npy"), mmap_mode="r")
+
+    def iter_batches(self, batch_size: int = 65536, fields=("observations", "labels")) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Iterate lazily over batches of the part, batches never span two shards.
+
+        Args:
+            batch_size (int, optional): Maximum number of samples per batch. Defaults to 65536.
+            fields (tuple, optional): Fields to include in each batch. Defaults to ("observations", "labels").
+
+        Yields:
+            dict: Memory-mapped slices of the requested fields.
+        """
+        for shard_idx, shard in enumerate(self.shards):
+            arrays = {field: self.open_shard(shard_idx, field) for field in fields}
+            for batch_start in range(0, shard["n_samples"], batch_size):
+                yield {field: array[batch_start:batch_start + batch_size] for field, array in arrays.items()}
@@ -1,6 +1,195 @@
-import operator
+import os
+import json
+import struct
 from typing import List
 import numpy as np
+import kernels
+from transitions import SparseTransition
+from utils import bounded_map, process_pool
+
+MODEL_MAGIC = b"HMMMODEL"
+MODEL_SCHEMA_VERSION = 1
+MODEL_ALIGNMENT = 64
+#? Optional arrays of the model file, stored as float64 so partial_fit can continue after load
+MODEL_COUNT_ARRAYS = ("pi_counts", "transition_counts", "emission_counts")
+
+
+def _log(probabilities: np.ndarray) -> np.ndarray:
+    """Return the natural logarithm of probabilities, mapping zeros to -inf without warnings."""
+    with np.errstate(divide="ignore"):
+        return np.log(probabilities)
+
+
+def _align(offset: int) -> int:
+    """Round a file offset up to the next multiple of MODEL_ALIGNMENT."""
+    return -(-offset // MODEL_ALIGNMENT) * MODEL_ALIGNMENT
+
+
+def _require_keys(mapping, keys, prefix: str = ""):
+    """Raise a ValueError naming the first key of keys missing from a model header mapping."""
+    if not isinstance(mapping, dict):
+        raise ValueError(f"Model header {prefix.rstrip('.') or 'root'} must be a JSON object")
+    for key in keys:
+        if key not in mapping:
+            raise ValueError(f"Model header is missing required key '{prefix}{key}'")
+
+
+def _quantize_log_probabilities(probabilities: np.ndarray, dtype: str):
+    """
+    Quantize probabilities as float16 or int8 log-probabilities.
+
+    int8 values are spread linearly between the smallest finite log-probability and the largest one,
+    -128 is reserved for zero probabilities.
+
+    Args:
+        probabilities (np.ndarray): Probabilities to store.
+        dtype (str): "float16" or "int8".
+
+    Returns:
+        tuple: The quantized array and its header metadata.
+    """
+    log_probabilities = _log(probabilities)
+    if dtype == "float16":
+        return log_probabilities.astype(np.float16), {"encoding": "logprob"}
+
+    finite = np.isfinite(log_probabilities)
+    low = float(log_probabilities[finite].min()) if finite.any() else 0.0
+    high = float(log_probabilities[finite].max()) if finite.any() else 0.0
+    scale = (high - low) / 254 if high > low else 1.0
+    quantized = np.full(log_probabilities.shape, -128, dtype=np.int8)
+    quantized[finite] = np.round((log_probabilities[finite] - low) / scale).astype(np.int16) - 127
+    return quantized, {"encoding": "logprob", "low": low, "scale": scale}
+
+
+def _dequantize_log_probabilities(quantized: np.ndarray, meta: dict) -> np.ndarray:
+    """Convert quantized log-probabilities back to probabilities, renormalizing the quantization error."""
+    if quantized.dtype == np.int8:
+        log_probabilities = (quantized.astype(np.float64) + 127) * meta["scale"] + meta["low"]
+        log_probabilities[quantized == -128] = -np.inf
+    else:
+        log_probabilities = quantized.astype(np.float64)
+    probabilities = np.exp(log_probabilities)
+    totals = probabilities.sum(axis=-1, keepdims=True)
+    return probabilities / np.where(totals > 0, totals, 1.0)
+
+
+def pad_observations(observations, lengths=None):
+    """
+    Pack a batch of observation sequences into a padded 2-D integer array.
+
+    Args:
+        observations (list or np.ndarray): Either a ragged list of sequences or a padded 2-D array.
+        lengths (list or np.ndarray, optional): Valid length of each row of a padded array.
+            Defaults to the full row length for arrays and to the sequence lengths for lists.
+
+    Returns:
+        tuple: A tuple containing the padded (n_sample, max_length) codes and the (n_sample,) lengths.
+    """
+    if isinstance(observations, np.ndarray) and observations.ndim == 2:
+        padded = observations.astype(np.intp, copy=False)
+        if lengths is None:
+            lengths = np.full(padded.shape[0], padded.shape[1], dtype=np.intp)
+        return padded, np.asarray(lengths, dtype=np.intp)
+
+    sequences = [np.asarray(seq, dtype=np.intp) for seq in observations]
+    if lengths is None:
+        lengths = [len(seq) for seq in sequences]
+    lengths = np.asarray(lengths, dtype=np.intp)
+    padded = np.zeros((len(sequences), lengths.max(initial=0)), dtype=np.intp)
+    for sample_idx, seq in enumerate(sequences):
+        padded[sample_idx, :lengths[sample_idx]] = seq[:lengths[sample_idx]]
+    return padded, lengths
+
+
+def expectation_step(pi, transition, emission, observations, lengths, state_mask=None):
+    """
+    Compute the Baum-Welch sufficient statistics of a padded batch of sequences.
+
+    Forward and backward variables are computed for the whole batch with (n_sample, n_state) operations
+    per time step, expected transitions are reduced with einsum without materializing per-step matrices.
+    With a SparseTransition every step costs O(nnz) and only the expected counts of its entries are computed.
+
+    Args:
+        pi (np.ndarray): Prior probabilities (n_state,).
+        transition (np.ndarray or SparseTransition): Transition probabilities (n_state, n_state).
+        emission (np.ndarray): Emission probabilities (n_state, n_emission).
+        observations (np.ndarray): Padded emission codes (n_sample, max_length).
+        lengths (np.ndarray): Valid length of each sequence (n_sample,).
+        state_mask (np.ndarray, optional): Allowed states of each sequence (n_sample, n_state),
+            used to clamp labeled sequences. Defaults to all states allowed.
+
+    Returns:
+        tuple: Expected initial state counts (n_state,), expected transition counts (n_state, n_state), or (nnz,)
+            aligned with transition.data for a SparseTransition, expected emission counts (n_state, n_emission)
+            and the total log-likelihood of the batch.
+    """
+    n_sample, max_length = observations.shape
+    n_state, n_emission = emission.shape
+    codes = np.clip(observations, 0, n_emission - 1)
+    valid = np.arange(max_length) < lengths[:, None]
+    tiny = np.finfo(np.float64).tiny
+
+    #? Emission probability of every step, shape (n_sample, max_length, n_state)
+    step_emission = emission.T[codes]
+    if state_mask is not None:
+        step_emission = step_emission * state_mask[:, None, :]
+
+    alpha = np.empty((n_sample, max_length, n_state), dtype=np.float64)
+    scales = np.ones((n_sample, max_length), dtype=np.float64)
+    state_prob = pi * step_emission[:, 0]
+    for observation_idx in range(max_length):
+        if observation_idx > 0:
+            state_prob = (alpha[:, observation_idx - 1] @ transition) * step_emission[:, observation_idx]
+        step_scale = np.maximum(state_prob.sum(axis=1), tiny)
+        scales[:, observation_idx] = np.where(valid[:, observation_idx], step_scale, 1.0)
+        alpha[:, observation_idx] = state_prob / step_scale[:, None]
+
+    beta = np.ones((n_sample, max_length, n_state), dtype=np.float64)
+    for observation_idx in range(max_length - 2, -1, -1):
+        next_prob = step_emission[:, observation_idx + 1] * beta[:, observation_idx + 1]
+        step_beta = next_prob @ transition.T / scales[:, observation_idx + 1, None]
+        beta[:, observation_idx] = np.where(valid[:, observation_idx + 1, None], step_beta, 1.0)
+
+    gamma = alpha * beta * valid[..., None]
+    pi_acc = gamma[:, 0].sum(axis=0)
+
+    next_prob = step_emission[:, 1:] * beta[:, 1:] / scales[:, 1:, None] * valid[:, 1:, None]
+    if isinstance(transition, SparseTransition):
+        transition_acc = transition.data * np.einsum("nte,nte->e", alpha[:, :-1, transition.sources],
+                                                     next_prob[:, :, transition.destinations])
+    else:
+        transition_acc = transition * np.einsum("nti,ntj->ij", alpha[:, :-1], next_prob)
+
+    emission_acc = np.zeros((n_emission, n_state), dtype=np.float64)
+    np.add.at(emission_acc, codes[valid], gamma[valid])
+
+    log_likelihood = float(np.log(scales).sum())
+    return pi_acc, transition_acc, emission_acc.T, log_likelihood
+
+
+def _expectation_shard(pi, transition, emission, observations, lengths, state_mask, batch_size, backend="numpy"):
+    """Accumulate the Baum-Welch sufficient statistics of a shard of sequences batch by batch."""
+    n_state, n_emission = emission.shape
+    pi_acc = np.zeros(n_state, dtype=np.float64)
+    transition_acc = np.zeros(transition.nnz if isinstance(transition, SparseTransition) else (n_state, n_state), dtype=np.float64)
+    emission_acc = np.zeros((n_state, n_emission), dtype=np.float64)
+    log_likelihood = 0.0
+    for batch_start in range(0, len(observations), batch_size):
+        batch = slice(batch_start, batch_start + batch_size)
+        batch_lengths = lengths[batch]
+        batch_observations = observations[batch, :batch_lengths.max(initial=1)]
+        batch_mask = None if state_mask is None else state_mask[batch]
+        if backend == "numba":
+            batch_codes = np.clip(batch_observations, 0, n_emission - 1)
+            stats = kernels.expectation_batch(pi, transition, emission, batch_codes, batch_lengths, batch_mask)
+        else:
+            stats = expectation_step(pi, transition, emission, batch_observations, batch_lengths, batch_mask)
+        pi_acc += stats[0]
+        transition_acc += stats[1]
+        emission_acc += stats[2]
+        log_likelihood += stats[3]
+    return pi_acc, transition_acc, emission_acc, log_likelihood
+
 
 class HMM:
     """
@@ -9,119 +198,651 @@ class HMM:
     Attributes:
         n_state (int): Number of states (classes) in the HMM.
         n_emission (int): Number of possible emissions (angle differences) in the HMM.
-        emission (dict): Emission probabilities for each state and emission.
-        pi (dict): Prior probabilities for each state.
-        transition (dict): Transition probabilities between states.
+        emission (np.ndarray): Emission probabilities with shape (n_state, n_emission).
+        pi (np.ndarray): Prior probabilities for each state with shape (n_state,).
+        transition (np.ndarray): Transition probabilities between states with shape (n_state, n_state).
+        smoothing (float): Laplace pseudo-count added to the emission counts.
+        emission_counts (np.ndarray): Accumulated emission counts with shape (n_state, n_emission), None when
+            the model was loaded from a file without counts.
+        transition_counts (np.ndarray): Accumulated transition counts with shape (n_state, n_state).
+        pi_counts (np.ndarray): Accumulated initial state counts with shape (n_state,).
+        backend (str): Kernel backend of Viterbi and the Baum-Welch E-step, "numpy" or "numba".
+        sparse_transition (bool): Keep transition as a SparseTransition, so decoding scales with its nonzeros.
 
     Methods:
-        __init__(n_state, n_emission): Initialize the HMM with the specified number of states and emissions.
+        __init__(n_state, n_emission, smoothing, backend, sparse_transition): Initialize the HMM with the specified number of states and emissions.
+        reset_counts(): Reset the count accumulators of the supervised training.
+        encode_observations(observations): Convert observations to an array of integer emission codes.
         fit(samples): Train the HMM using the provided training samples.
+        partial_fit(samples, decay): Update the HMM with new labeled samples.
+        fit_batches(batches): Train the HMM from batches of observation codes and labels.
+        fit_em(samples, n_iter, tol, n_jobs, batch_size, smoothing, random_state): Train the HMM with Baum-Welch.
+        fit_em_batches(batches, n_iter, tol, n_jobs, batch_size, smoothing, random_state): Baum-Welch over
+            batches re-read on every iteration.
+        viterbi(observations): Find the most likely state path and its log-likelihood.
+        forward(observations): Run the scaled forward algorithm.
+        backward(observations, scales): Run the scaled backward algorithm.
+        score(observations): Compute the log-likelihood of a sequence of observations.
         predict(observations): Predict the state of a sequence of observations using the Viterbi algorithm.
+        predict_batch(observations, lengths): Run the Viterbi algorithm on a whole batch of sequences at once.
         save(path): Save the trained HMM model to a file.
         load(path): Load a trained HMM model from a file.
         __str__(): Return a string representation of the HMM's properties.
     """
-    def __init__(self, n_state: int, n_emission: int) -> None:
-        """Initialize the Hidden Markov Model."""
+    def __init__(self, n_state: int, n_emission: int, smoothing: float = 0.0, backend: str = "auto",
+                 sparse_transition: bool = False) -> None:
+        """
+        Initialize the Hidden Markov Model, "auto" backend selects numba when it is installed.
+
+        With sparse_transition, transition is a SparseTransition (identity until trained or set) and Viterbi,
+        forward and backward cost O(nnz) per step instead of O(n_state^2). Dense matrices assigned to transition
+        are converted, keeping their nonzero entries.
+        """
         self.n_state = n_state
         self.n_emission = n_emission
-        self.emission = {}
-        self.pi = {i:1/n_state for i in range(n_state)}
-        self.transition = {sA: {sB: 0 for sB in range(n_state)} for sA in range(n_state)}
-        for sidx in range(n_state):
-            self.transition[sidx][sidx]=1
-        for state_idx in range(self.n_state):
-            self.emission[state_idx] = {f"E{ne}":0 for ne in range(n_emission)}
+        self.smoothing = smoothing
+        self.backend = kernels.resolve_backend(backend)
+        self.sparse_transition = sparse_transition
+        self.reset_counts()
+        self.emission = np.zeros((n_state, n_emission), dtype=np.float64)
+        self.pi = np.full(n_state, 1 / n_state, dtype=np.float64)
+        self.transition = SparseTransition.identity(n_state) if sparse_transition else np.eye(n_state, dtype=np.float64)
+
+    @property
+    def emission(self) -> np.ndarray:
+        """Emission probabilities, derived from emission_counts after an update and cached."""
+        if self._emission is None:
+            counts = self.emission_counts + self.smoothing
+            totall = counts.sum(axis=1, keepdims=True)
+            self._emission = np.where(totall > 0, counts / np.where(totall > 0, totall, 1.0), 1 / self.n_emission)
+        return self._emission
+
+    @emission.setter
+    def emission(self, value: np.ndarray):
+        self._emission = value
+
+    @property
+    def pi(self) -> np.ndarray:
+        """Prior probabilities, derived from pi_counts after an update and cached."""
+        if self._pi is None:
+            totall = self.pi_counts.sum()
+            self._pi = self.pi_counts / totall if totall > 0 else np.full(self.n_state, 1 / self.n_state)
+        return self._pi
+
+    @pi.setter
+    def pi(self, value: np.ndarray):
+        self._pi = value
+
+    @property
+    def transition(self):
+        """Transition probabilities, derived from transition_counts after an update and cached."""
+        if self._transition is None:
+            totall = self.transition_counts.sum(axis=1, keepdims=True)
+            self.transition = np.where(totall > 0, self.transition_counts / np.where(totall > 0, totall, 1.0),
+                                       np.eye(self.n_state))
+        return self._transition
+
+    @transition.setter
+    def transition(self, value):
+        if value is not None and self.sparse_transition and not isinstance(value, SparseTransition):
+            value = SparseTransition.from_dense(value)
+        elif isinstance(value, SparseTransition) and not self.sparse_transition:
+            value = value.to_dense()
+        self._transition = value
+
+    def dense_transition(self) -> np.ndarray:
+        """Return the transition probabilities as a dense (n_state, n_state) array."""
+        transition = self.transition
+        return transition.to_dense() if isinstance(transition, SparseTransition) else transition
+
+    def reset_counts(self):
+        """Reset the count accumulators of the supervised training."""
+        self.emission_counts = np.zeros((self.n_state, self.n_emission), dtype=np.float64)
+        self.transition_counts = np.zeros((self.n_state, self.n_state), dtype=np.float64)
+        self.pi_counts = np.zeros(self.n_state, dtype=np.float64)
+
+    def encode_observations(self, observations) -> np.ndarray:
+        """
+        Convert observations to an array of integer emission codes.
+
+        Args:
+            observations (list or np.ndarray): Integer emission codes.
+
+        Returns:
+            np.ndarray: 1-D array of integer emission codes.
+        """
+        return np.asarray(observations, dtype=np.intp)
 
     def fit(self, samples):
         """Train the Hidden Markov Model using the provided training samples."""
-        for sample in samples:
-            observations = sample["observations"]
-            for ob in observations:
-                self.emission[sample['label']][ob] += 1 
-        
-        for state_idx in range(self.n_state):
-            totall = sum(self.emission[state_idx][key] for key in self.emission[state_idx])
-            self.emission[state_idx] = {k:v/totall for k,v in self.emission[state_idx].items()}
+        self.reset_counts()
+        self.partial_fit(samples)
 
+    def partial_fit(self, samples, decay: float = 1.0):
+        """
+        Update the Hidden Markov Model with new labeled samples without retraining from scratch.
 
-    def predict(self, observations: List):
+        Args:
+            samples (list): Samples with "observations" and "label".
+            decay (float, optional): Factor applied to the previous counts before adding the new ones,
+                values below 1 make older samples fade exponentially. Defaults to 1.0.
         """
-        Predict the state of a sequence of observations using the Viterbi algorithm.
+        observations, lengths = pad_observations([self.encode_observations(sample["observations"]) for sample in samples])
+        labels = np.asarray([sample["label"] for sample in samples], dtype=np.intp)
+        self._accumulate_counts(observations, lengths, labels, decay=decay)
+
+    def fit_batches(self, batches):
+        """
+        Train the Hidden Markov Model from batches of observation codes and labels.
+
+        Args:
+            batches (iterable): Iterable of (observations, labels) tuples with shapes (n_sample, n_observation)
+                and (n_sample,), e.g. memory-mapped dataset shards.
+        """
+        self.reset_counts()
+        for observations, labels in batches:
+            observations, lengths = pad_observations(np.asarray(observations))
+            self._accumulate_counts(observations, lengths, np.asarray(labels, dtype=np.intp))
+
+    def _accumulate_counts(self, observations: np.ndarray, lengths: np.ndarray, labels: np.ndarray, decay: float = 1.0):
+        """
+        Add the sufficient statistics of labeled sequences to the count accumulators.
+
+        Every step of a sequence is emitted by the state of its label, so the sequence adds its emission
+        codes, length - 1 self transitions and one initial state count.
+
+        Args:
+            observations (np.ndarray): Padded emission codes (n_sample, max_length).
+            lengths (np.ndarray): Valid length of each sequence (n_sample,).
+            labels (np.ndarray): State of each sequence (n_sample,).
+            decay (float, optional): Factor applied to the previous counts. Defaults to 1.0.
+        """
+        if self.emission_counts is None:
+            raise ValueError("The count accumulators are unknown, the model was loaded from a file saved without "
+                             "counts. Call fit to train from scratch instead of partial_fit")
+        if decay != 1.0:
+            self.emission_counts *= decay
+            self.transition_counts *= decay
+            self.pi_counts *= decay
+
+        valid = np.arange(observations.shape[1]) < lengths[:, None]
+        flat_codes = labels[:, None] * self.n_emission + observations
+        self.emission_counts += np.bincount(flat_codes[valid], minlength=self.emission_counts.size).reshape(self.n_state, self.n_emission)
+        np.add.at(self.transition_counts, (labels, labels), np.maximum(lengths - 1, 0))
+        self.pi_counts += np.bincount(labels[lengths > 0], minlength=self.n_state)
+
+        #? Probabilities are derived again on the next access
+        self.emission = None
+        self.pi = None
+        self.transition = None
+
+    def fit_em(self, samples, n_iter: int = 100, tol: float = 1e-4, n_jobs: int = 1,
+               batch_size: int = 1024, smoothing: float = 1e-6, random_state=None):
+        """
+        Train the Hidden Markov Model with the Baum-Welch (EM) algorithm.
+
+        Samples with a "label" other than None or -1 are clamped to that state, the rest are unlabeled.
+        The E-step runs over batches of sequences and is sharded across n_jobs worker processes,
+        the sufficient statistics of all shards are summed before the M-step.
+        An untrained model starts from random parameters, otherwise from its current parameters.
+
+        Args:
+            samples (list): Samples with "observations" and an optional "label".
+            n_iter (int, optional): Maximum number of EM iterations. Defaults to 100.
+            tol (float, optional): Stop when the log-likelihood improves by less than tol. Defaults to 1e-4.
+            n_jobs (int, optional): Number of worker processes for the E-step. Defaults to 1.
+            batch_size (int, optional): Number of sequences per vectorized E-step batch. Defaults to 1024.
+            smoothing (float, optional): Pseudo-count added to the expected emission counts. Defaults to 1e-6.
+            random_state (int, optional): Seed of the random initialization. Defaults to None.
+
+        Returns:
+            HMM: The trained model, with the log-likelihood of every iteration in log_likelihood_trace.
+        """
+        observations, lengths = pad_observations([self.encode_observations(sample["observations"]) for sample in samples])
+        labels = np.asarray([-1 if sample.get("label") is None else sample["label"] for sample in samples], dtype=np.intp)
+        shards = np.array_split(np.arange(len(samples)), max(1, min(n_jobs, len(samples))))
+
+        def iter_shards():
+            for shard in shards:
+                yield observations[shard], lengths[shard], labels[shard]
+
+        return self._fit_em(iter_shards, n_iter=n_iter, tol=tol, n_jobs=n_jobs, batch_size=batch_size,
+                            smoothing=smoothing, random_state=random_state)
+
+    def fit_em_batches(self, batches, n_iter: int = 100, tol: float = 1e-4, n_jobs: int = 1,
+                       batch_size: int = 1024, smoothing: float = 1e-6, random_state=None):
+        """
+        Train the Hidden Markov Model with the Baum-Welch (EM) algorithm from batches of observation codes.
+
+        Every iteration reads the batches again and only keeps the summed sufficient statistics, so datasets
+        larger than memory can be trained from memory-mapped shards. Labels of -1 are unlabeled.
+
+        Args:
+            batches (callable): Function returning a fresh iterable of (observations, labels) tuples with shapes
+                (n_sample, n_observation) and (n_sample,), e.g. lambda: pp.iter_observations(dataset).
+            n_iter (int, optional): Maximum number of EM iterations. Defaults to 100.
+            tol (float, optional): Stop when the log-likelihood improves by less than tol. Defaults to 1e-4.
+            n_jobs (int, optional): Number of worker processes, each batch is one E-step task. Defaults to 1.
+            batch_size (int, optional): Number of sequences per vectorized E-step batch. Defaults to 1024.
+            smoothing (float, optional): Pseudo-count added to the expected emission counts. Defaults to 1e-6.
+            random_state (int, optional): Seed of the random initialization. Defaults to None.
+
+        Returns:
+            HMM: The trained model, with the log-likelihood of every iteration in log_likelihood_trace.
+        """
+        def iter_shards():
+            for observations, labels in batches():
+                observations, lengths = pad_observations(np.asarray(observations))
+                yield observations, lengths, np.asarray(labels, dtype=np.intp)
+
+        return self._fit_em(iter_shards, n_iter=n_iter, tol=tol, n_jobs=n_jobs, batch_size=batch_size,
+                            smoothing=smoothing, random_state=random_state)
+
+    def _state_mask(self, labels: np.ndarray):
+        """Return the allowed states (n_sample, n_state) of labeled sequences, or None if none is labeled."""
+        labeled = labels >= 0
+        if not labeled.any():
+            return None
+        state_mask = np.ones((len(labels), self.n_state), dtype=np.float64)
+        state_mask[labeled] = 0.0
+        state_mask[labeled, labels[labeled]] = 1.0
+        return state_mask
+
+    def _fit_em(self, iter_shards, n_iter: int, tol: float, n_jobs: int, batch_size: int, smoothing: float,
+                random_state):
+        """Baum-Welch iterations over the (observations, lengths, labels) shards yielded by iter_shards()."""
+        if not self.emission.any():
+            rng = np.random.default_rng(random_state)
+            self.emission = rng.dirichlet(np.ones(self.n_emission), size=self.n_state)
+            transition = rng.dirichlet(np.ones(self.n_state), size=self.n_state)
+            if self.sparse_transition:
+                #? Random values on the allowed transitions only, so left-to-right and banded structures are kept
+                support = self.transition
+                data = transition[support.sources, support.destinations]
+                transition = support.with_data(data / np.bincount(support.sources, weights=data, minlength=self.n_state)[support.sources])
+            self.transition = transition
+
+        #? Workers come from a forkserver, so they are safe even after numba started its threads in this process
+        n_jobs = max(1, n_jobs)
+        #? The compiled kernel works on dense matrices, the NumPy E-step only visits the entries of a sparse transition
+        backend = "numpy" if self.sparse_transition else self.backend
+        self.log_likelihood_trace = []
+        executor = process_pool(n_jobs) if n_jobs > 1 else None
+        try:
+            for _ in range(n_iter):
+                #? A sparse transition stays sparse, its expected counts are only computed for its entries
+                transition = self.transition
+                params = (self.pi, transition, self.emission)
+                tasks = ((None, (*params, observations, lengths, self._state_mask(labels), batch_size, backend))
+                         for observations, lengths, labels in iter_shards())
+                if executor is None:
+                    results = (_expectation_shard(*args) for _, args in tasks)
+                else:
+                    #? Shards are summed in submission order, so the result does not depend on the worker timing
+                    results = (stats for _, stats in bounded_map(executor, _expectation_shard, tasks,
+                                                                 max_in_flight=2 * n_jobs, ordered=True))
+
+                pi_acc = np.zeros(self.n_state, dtype=np.float64)
+                transition_acc = np.zeros(transition.nnz if self.sparse_transition else (self.n_state, self.n_state), dtype=np.float64)
+                emission_acc = np.zeros((self.n_state, self.n_emission), dtype=np.float64)
+                log_likelihood = 0.0
+                for stats in results:
+                    pi_acc += stats[0]
+                    transition_acc += stats[1]
+                    emission_acc += stats[2]
+                    log_likelihood += stats[3]
+
+                #? M-step, rows without any expected count keep their previous values
+                pi_total = pi_acc.sum()
+                if pi_total > 0:
+                    self.pi = pi_acc / pi_total
+                if self.sparse_transition:
+                    #? Only the entries are re-estimated, normalized by the expected count of leaving their source
+                    transition_total = np.bincount(transition.sources, weights=transition_acc, minlength=self.n_state)[transition.sources]
+                    self.transition = transition.with_data(np.where(transition_total > 0, transition_acc / np.where(transition_total > 0, transition_total, 1.0), transition.data))
+                else:
+                    transition_total = transition_acc.sum(axis=1, keepdims=True)
+                    self.transition = np.where(transition_total > 0, transition_acc / np.where(transition_total > 0, transition_total, 1.0), transition)
+                emission_acc = emission_acc + smoothing
+                self.emission = emission_acc / emission_acc.sum(axis=1, keepdims=True)
+
+                self.log_likelihood_trace.append(log_likelihood)
+                if len(self.log_likelihood_trace) > 1 and log_likelihood - self.log_likelihood_trace[-2] < tol:
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if self.log_likelihood_trace:
+            #? The expected counts of the last E-step give the trained parameters, so partial_fit continues from them
+            self.pi_counts = pi_acc
+            if self.sparse_transition:
+                self.transition_counts = np.zeros((self.n_state, self.n_state), dtype=np.float64)
+                self.transition_counts[transition.sources, transition.destinations] = transition_acc
+            else:
+                self.transition_counts = transition_acc
+            self.emission_counts = emission_acc
+        return self
+
+    def viterbi(self, observations: List):
+        """
+        Find the most likely state path of a sequence of observations in log space.
 
         Args:
             observations (list): List of observations (angle differences) for prediction.
 
         Returns:
-            tuple: A tuple containing the predicted state and a dictionary of state votes.
+            tuple: A tuple containing the most likely state path as an int array and its log-likelihood.
+
+        Raises:
+            ValueError: If the sequence is empty.
         """
+        observations = self.encode_observations(observations)
         n_observation = len(observations)
-        observation_probabilities = {-1: self.pi}
-        for current_observation_idx, observation in enumerate(observations):
-            previous_observation_idx = current_observation_idx - 1
-            for current_state_idx in range(self.n_state):
-                previous_state_prob = []
-                for previous_state_idx in range(self.n_state):
-                    prior = observation_probabilities[previous_observation_idx][previous_state_idx]
-                    trans = self.transition[previous_state_idx][current_state_idx]
-                    emission = self.emission[current_state_idx][observation]
-                    prob = prior * trans * emission
-                    previous_state_prob.append(prob)
-
-                if current_observation_idx not in observation_probabilities:
-                    observation_probabilities[current_observation_idx] = {}
-                observation_probabilities[current_observation_idx][current_state_idx] = max(previous_state_prob)
-
-        # print("observation_probabilities", observation_probabilities)
-        state_vote = {state_idx:0 for state_idx in range(self.n_state)}
+        if n_observation == 0:
+            raise ValueError("Cannot decode an empty sequence of observations")
+        log_pi = _log(self.pi)
+        log_emission = _log(self.emission)
+        if self.sparse_transition:
+            return self._viterbi_sparse(observations, log_pi, log_emission)
+        log_transition = _log(self.transition)
+        if self.backend == "numba":
+            paths, scores = kernels.viterbi_batch(log_pi, log_transition, log_emission, observations[None],
+                                                  np.array([n_observation]))
+            return paths[0], float(scores[0])
+
+        #? Backpointers are preallocated, row t holds the best previous state for each state at step t
+        backpointers = np.zeros((n_observation, self.n_state), dtype=np.intp)
+        state_log_prob = log_pi + log_emission[:, observations[0]]
+        for observation_idx in range(1, n_observation):
+            scores = state_log_prob[:, None] + log_transition
+            backpointers[observation_idx] = scores.argmax(axis=0)
+            state_log_prob = scores.max(axis=0) + log_emission[:, observations[observation_idx]]
+
+        #? Backtracking from the best final state
+        path = np.empty(n_observation, dtype=np.intp)
+        path[-1] = state_log_prob.argmax()
+        for observation_idx in range(n_observation - 1, 0, -1):
+            path[observation_idx - 1] = backpointers[observation_idx, path[observation_idx]]
+        return path, float(state_log_prob[path[-1]])
+
+    def _viterbi_sparse(self, observations: np.ndarray, log_pi: np.ndarray, log_emission: np.ndarray):
+        """Viterbi over a SparseTransition, O(nnz) per step."""
+        n_observation = len(observations)
+        backpointers = np.zeros((n_observation, self.n_state), dtype=np.intp)
+        state_log_prob = log_pi + log_emission[:, observations[0]]
+        for observation_idx in range(1, n_observation):
+            best_log_prob, backpointers[observation_idx] = self.transition.viterbi_step(state_log_prob)
+            state_log_prob = best_log_prob + log_emission[:, observations[observation_idx]]
+
+        path = np.empty(n_observation, dtype=np.intp)
+        path[-1] = state_log_prob.argmax()
+        for observation_idx in range(n_observation - 1, 0, -1):
+            path[observation_idx - 1] = backpointers[observation_idx, path[observation_idx]]
+        return path, float(state_log_prob[path[-1]])
 
+    def forward(self, observations: List):
+        """
+        Run the scaled forward algorithm on a sequence of observations.
+
+        Args:
+            observations (list): List of observations (angle differences).
+
+        Returns:
+            tuple: A tuple containing the normalized forward variables (n_observation, n_state)
+                and the scaling factor of each step (n_observation,).
+        """
+        observations = self.encode_observations(observations)
+        n_observation = len(observations)
+        alpha = np.empty((n_observation, self.n_state), dtype=np.float64)
+        scales = np.empty(n_observation, dtype=np.float64)
+
+        state_prob = self.pi * self.emission[:, observations[0]]
         for observation_idx in range(n_observation):
-            observation_probabilities_state = observation_probabilities[observation_idx]
-            winner_state = max(observation_probabilities_state.items(), key=operator.itemgetter(1))[0]
-            state_vote[winner_state] += 1
+            if observation_idx > 0:
+                state_prob = (alpha[observation_idx - 1] @ self.transition) * self.emission[:, observations[observation_idx]]
+            scales[observation_idx] = state_prob.sum()
+            alpha[observation_idx] = state_prob / scales[observation_idx] if scales[observation_idx] > 0 else 0.0
+        return alpha, scales
+
+    def backward(self, observations: List, scales: np.ndarray):
+        """
+        Run the scaled backward algorithm on a sequence of observations.
+
+        Args:
+            observations (list): List of observations (angle differences).
+            scales (np.ndarray): Scaling factors returned by forward for the same observations.
+
+        Returns:
+            np.ndarray: The scaled backward variables (n_observation, n_state).
+        """
+        observations = self.encode_observations(observations)
+        n_observation = len(observations)
+        beta = np.empty((n_observation, self.n_state), dtype=np.float64)
+        beta[-1] = 1.0
+        for observation_idx in range(n_observation - 2, -1, -1):
+            next_prob = self.emission[:, observations[observation_idx + 1]] * beta[observation_idx + 1]
+            scale = scales[observation_idx + 1]
+            beta[observation_idx] = self.transition @ next_prob / scale if scale > 0 else 0.0
+        return beta
+
+    def score(self, observations: List) -> float:
+        """
+        Compute the log-likelihood of a sequence of observations with the forward algorithm.
+
+        Args:
+            observations (list): List of observations (angle differences).
+
+        Returns:
+            float: Log-likelihood of the observations under the model.
+        """
+        _, scales = self.forward(observations)
+        return float(_log(scales).sum())
+
+    def predict(self, observations: List):
+        """
+        Predict the state of a sequence of observations using the Viterbi algorithm.
+
+        Args:
+            observations (list): List of observations (angle differences) for prediction.
 
-        winner_class = max(observation_probabilities_state.items(), key=operator.itemgetter(1))[0]
+        Returns:
+            tuple: A tuple containing the predicted state and a dictionary of state votes.
+
+        Raises:
+            ValueError: If the sequence is empty.
+        """
+        path, _ = self.viterbi(observations)
+        votes = np.bincount(path, minlength=self.n_state)
+        state_vote = {state_idx: int(votes[state_idx]) for state_idx in range(self.n_state)}
+        winner_class = int(path[-1])
         return winner_class, state_vote
     
-    def save(self, path: str = "model.npz"):
+    def predict_batch(self, observations, lengths=None):
+        """
+        Predict the state of a batch of observation sequences using the Viterbi algorithm.
+
+        The whole batch is decoded with (n_sample, n_state, n_state) tensor operations per time step,
+        sequences shorter than the padded length keep their last trellis column. The numba backend decodes
+        the sequences in parallel with a compiled per-sequence loop instead, with identical results.
+
+        Args:
+            observations (list or np.ndarray): Padded 2-D array of emission codes or a ragged list of sequences.
+            lengths (list or np.ndarray, optional): Valid length of each padded row.
+
+        Returns:
+            tuple: A tuple containing the predicted classes (n_sample,), the Viterbi log-likelihoods (n_sample,)
+                and the state votes (n_sample, n_state), all empty for an empty batch.
+        """
+        observations, lengths = pad_observations(observations, lengths)
+        n_sample, max_length = observations.shape
+        if n_sample == 0:
+            return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float64), np.zeros((0, self.n_state), dtype=np.int64)
+        log_pi = _log(self.pi)
+        log_emission = _log(self.emission)
+        log_transition = None if self.sparse_transition else _log(self.transition)
+
+        #? Padding codes may be arbitrary, clip them so they can be used as indices
+        codes = np.clip(observations, 0, self.n_emission - 1)
+        sample_idxs = np.arange(n_sample)
+        if self.backend == "numba" and not self.sparse_transition:
+            paths, scores = kernels.viterbi_batch(log_pi, log_transition, log_emission, codes, lengths)
+        else:
+            backpointers = np.zeros((n_sample, max_length, self.n_state), dtype=np.intp)
+            state_log_prob = log_pi + log_emission[:, codes[:, 0]].T
+            for observation_idx in range(1, max_length):
+                if self.sparse_transition:
+                    best_log_prob, backpointers[:, observation_idx] = self.transition.viterbi_step(state_log_prob)
+                else:
+                    scores = state_log_prob[:, :, None] + log_transition
+                    backpointers[:, observation_idx] = scores.argmax(axis=1)
+                    best_log_prob = scores.max(axis=1)
+                step_log_prob = best_log_prob + log_emission[:, codes[:, observation_idx]].T
+                active = observation_idx < lengths
+                state_log_prob = np.where(active[:, None], step_log_prob, state_log_prob)
+
+            #? Backtracking, each sample starts from its own last valid step
+            paths = np.zeros((n_sample, max_length), dtype=np.intp)
+            current_state = state_log_prob.argmax(axis=1)
+            scores = state_log_prob[sample_idxs, current_state]
+            for observation_idx in range(max_length - 1, 0, -1):
+                active = observation_idx < lengths
+                paths[active, observation_idx] = current_state[active]
+                previous_state = backpointers[sample_idxs, observation_idx, current_state]
+                current_state = np.where(active, previous_state, current_state)
+            paths[:, 0] = current_state
+
+        valid = np.arange(max_length) < lengths[:, None]
+        votes = np.zeros((n_sample, self.n_state), dtype=np.int64)
+        np.add.at(votes, (np.repeat(sample_idxs, max_length)[valid.ravel()], paths[valid]), 1)
+        classes = paths[sample_idxs, np.maximum(lengths - 1, 0)]
+        return classes, scores, votes
+
+    def save(self, path: str = "model.hmm", dtype: str = "float64", counts: bool = True):
         """
         Save the trained Hidden Markov Model to a file.
 
+        The file holds a magic string, a small JSON header and the raw parameter arrays aligned to
+        MODEL_ALIGNMENT bytes, so float64 models can be memory-mapped and nothing is pickled.
+
         Args:
-            path (str, optional): Path to save the model file. Defaults to "model.npz".
+            path (str, optional): Path to save the model file. Defaults to "model.hmm".
+            dtype (str, optional): "float64" stores probabilities, "float16" or "int8" store quantized
+                log-probabilities for large emission alphabets. Defaults to "float64".
+            counts (bool, optional): Also store the float64 count accumulators, so partial_fit keeps the
+                trained parameters after load. Defaults to True.
         """
-        if not path.endswith(".npz"):
-            path += ".npz"
+        if not path.endswith(".hmm"):
+            path += ".hmm"
+        if dtype not in ("float64", "float16", "int8"):
+            raise ValueError(f"Unsupported model dtype {dtype}, expected 'float64', 'float16' or 'int8'")
+
+        arrays = {}
+        header = {"schema_version": MODEL_SCHEMA_VERSION, "n_state": self.n_state, "n_emission": self.n_emission, "arrays": {}}
+        for name in ("pi", "transition", "emission"):
+            probabilities = self.dense_transition() if name == "transition" else getattr(self, name)
+            probabilities = np.asarray(probabilities, dtype=np.float64)
+            if dtype == "float64":
+                arrays[name], meta = probabilities, {"encoding": "prob"}
+            else:
+                arrays[name], meta = _quantize_log_probabilities(probabilities, dtype)
+            meta.update({"dtype": arrays[name].dtype.str, "shape": list(arrays[name].shape)})
+            header["arrays"][name] = meta
+        if counts and self.emission_counts is not None:
+            for name in MODEL_COUNT_ARRAYS:
+                arrays[name] = np.asarray(getattr(self, name), dtype=np.float64)
+                header["arrays"][name] = {"encoding": "counts", "dtype": arrays[name].dtype.str,
+                                          "shape": list(arrays[name].shape)}
+
+        #? Offsets depend on the header length, so they are filled in until the header size is stable
+        header_size = 0
+        while True:
+            offset = _align(len(MODEL_MAGIC) + 4 + header_size)
+            for name, array in arrays.items():
+                header["arrays"][name]["offset"] = offset
+                offset = _align(offset + array.nbytes)
+            header_bytes = json.dumps(header).encode()
+            if len(header_bytes) == header_size:
+                break
+            header_size = len(header_bytes)
+
         with open(path, 'wb') as file:
-            np.savez_compressed(file,
-                                n_state=self.n_state,
-                                n_emission=self.n_emission,
-                                emission=self.emission,
-                                pi=self.pi,
-                                transition=self.transition)
+            file.write(MODEL_MAGIC)
+            file.write(struct.pack("<I", len(header_bytes)))
+            file.write(header_bytes)
+            for name, array in arrays.items():
+                file.write(b"\0" * (header["arrays"][name]["offset"] - file.tell()))
+                file.write(np.ascontiguousarray(array).tobytes())
 
-    def load(self, path: str = "model.npz"):
+    def load(self, path: str = "model.hmm", mmap: bool = False):
         """
-        Load a trained Hidden Markov Model from a file.
+        Load a trained Hidden Markov Model from a file and validate it.
+
+        The count accumulators are restored when the file has them, otherwise they are unknown and
+        partial_fit raises until the model is trained again with fit.
 
         Args:
-            path (str, optional): Path to the model file. Defaults to "model.npz".
+            path (str, optional): Path to the model file. Defaults to "model.hmm".
+            mmap (bool, optional): Memory-map float64 parameters instead of reading them. Defaults to False.
+
+        Raises:
+            ValueError: If the file is not a valid model, its header misses a required key, or it does not
+                match n_state and n_emission.
         """
         with open(path, 'rb') as file:
-            data = np.load(file, allow_pickle=True)
-            n_state = data["n_state"]
-            n_emission = data["n_emission"]
-            
-            if (self.n_state!=n_state):
-                print(f"n_state is incompatible {self.n_state} vs {n_state}")
+            magic = file.read(len(MODEL_MAGIC))
+            if magic != MODEL_MAGIC:
+                raise ValueError(f"{path} is not an HMM model file")
+            (header_size,) = struct.unpack("<I", file.read(4))
+            header = json.loads(file.read(header_size))
+        file_size = os.path.getsize(path)
+
+        _require_keys(header, ("schema_version", "n_state", "n_emission", "arrays"))
+        if header["schema_version"] != MODEL_SCHEMA_VERSION:
+            raise ValueError(f"Unsupported model schema version {header['schema_version']}, expected {MODEL_SCHEMA_VERSION}")
+        if (self.n_state, self.n_emission) != (header["n_state"], header["n_emission"]):
+            raise ValueError(f"Model is incompatible, n_state {self.n_state} vs {header['n_state']}, "
+                             f"n_emission {self.n_emission} vs {header['n_emission']}")
 
-            if (self.n_emission!=n_emission):
-                print(f"n_emission is incompatible {self.n_emission} vs {n_emission}")
+        expected_shapes = {"pi": (self.n_state,),
+                           "transition": (self.n_state, self.n_state),
+                           "emission": (self.n_state, self.n_emission)}
+        _require_keys(header["arrays"], expected_shapes, prefix="arrays.")
+        has_counts = all(name in header["arrays"] for name in MODEL_COUNT_ARRAYS)
+        if has_counts:
+            expected_shapes.update({name: expected_shapes[name[:-len("_counts")]] for name in MODEL_COUNT_ARRAYS})
 
-            self.emission = data["emission"].item()
-            self.pi = data["pi"].item() 
-            self.transition = data["transition"].item()
+        for name, shape in expected_shapes.items():
+            meta = header["arrays"][name]
+            _require_keys(meta, ("encoding", "dtype", "shape", "offset"), prefix=f"arrays.{name}.")
+            if meta["encoding"] not in (("counts",) if name in MODEL_COUNT_ARRAYS else ("prob", "logprob")):
+                raise ValueError(f"{name} has unsupported encoding {meta['encoding']}")
+            if meta["encoding"] == "logprob" and meta["dtype"] == np.dtype(np.int8).str:
+                _require_keys(meta, ("low", "scale"), prefix=f"arrays.{name}.")
+            dtype = np.dtype(meta["dtype"])
+            if tuple(meta["shape"]) != shape:
+                raise ValueError(f"{name} has shape {tuple(meta['shape'])}, expected {shape}")
+            if meta["offset"] + dtype.itemsize * int(np.prod(shape)) > file_size:
+                raise ValueError(f"{name} exceeds the end of {path}")
 
+            #? Counts are updated in place by partial_fit, so they are always read into memory
+            if mmap and meta["encoding"] == "prob":
+                array = np.memmap(path, dtype=dtype, mode="r", offset=meta["offset"], shape=shape)
+            else:
+                array = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=meta["offset"]).reshape(shape)
+            if meta["encoding"] == "logprob":
+                array = _dequantize_log_probabilities(array, meta)
+
+            if not np.isfinite(array).all() or (array < 0).any():
+                raise ValueError(f"{name} contains invalid {'counts' if meta['encoding'] == 'counts' else 'probabilities'}")
+            if meta["encoding"] != "counts" and not np.allclose(array.sum(axis=-1), 1.0, atol=1e-6):
+                raise ValueError(f"{name} rows do not sum to 1")
+            setattr(self, name, array)
+
+        if not has_counts:
+            self.emission_counts = None
+            self.transition_counts = None
+            self.pi_counts = None
 
     def __str__(self) -> str:
         """Return a string representation of the Hidden Markov Model's properties."""
@@ -129,9 +850,257 @@ class HMM:
         msg += f"n_state: {self.n_state}\n"
         msg += f"n_emission: {self.n_emission}\n"
         msg += f"pi: {self.pi}\n"
-        msg += f"emission: {self.emission}\n"
-        msg += f"transition: {self.transition}\n"
+        emission_names = " ".join(f"E{code}" for code in range(self.n_emission))
+        msg += f"emission ({emission_names}):\n{self.emission}\n"
+        msg += f"transition:\n{self.transition}\n"
         return msg
 
 
+class StreamingViterbi:
+    """
+    Online Viterbi decoder of an unbounded stream of observations with fixed-lag smoothing.
+
+    Each push costs O(n_state^2 + lag), O(nnz + lag) with a SparseTransition, and memory stays O(lag * n_state): only the current trellis
+    column and a ring buffer of the last lag backpointer rows are kept. Once lag more observations have
+    been pushed, the state of a step is finalized by backtracking from the current best state.
+
+    Attributes:
+        hmm_obj (HMM): The trained model.
+        lag (int): Number of observations a state waits for before it is finalized, 0 finalizes immediately.
+        n_observation (int): Number of observations pushed since the last reset.
+
+    Methods:
+        __init__(hmm_obj, lag): Initialize the decoder.
+        reset(): Start a new stream.
+        push(observation): Add one observation and return the newly finalized state, if any.
+        best_state: Most likely current state.
+        log_likelihood: Log-likelihood of the best path so far.
+        flush(): Return the states of the steps that are not finalized yet.
+    """
+    def __init__(self, hmm_obj: HMM, lag: int = 8) -> None:
+        """Initialize the decoder with the log-parameters of a trained model."""
+        if lag < 0:
+            raise ValueError(f"lag must be non-negative, got {lag}")
+        self.hmm_obj = hmm_obj
+        self.lag = lag
+        self._log_pi = _log(hmm_obj.pi)
+        self._sparse_transition = hmm_obj.transition if hmm_obj.sparse_transition else None
+        self._log_transition = None if hmm_obj.sparse_transition else _log(hmm_obj.transition)
+        #? Emission rows per code, contiguous for the lookup of every push
+        self._log_emission = np.ascontiguousarray(_log(hmm_obj.emission).T)
+        self._backpointers = np.zeros((max(lag, 1), hmm_obj.n_state), dtype=np.intp)
+        self.reset()
+
+    def reset(self):
+        """Start a new stream."""
+        self.n_observation = 0
+        self._state_log_prob = None
+        self._offset = 0.0
+
+    def push(self, observation: int):
+        """
+        Add one observation to the stream.
+
+        Args:
+            observation (int): Emission code of the new observation.
+
+        Returns:
+            int: The finalized state of the observation pushed lag steps earlier, or None during the first lag pushes.
+        """
+        code = int(observation)
+        if not 0 <= code < self.hmm_obj.n_emission:
+            raise ValueError(f"Observation {code} out of range for {self.hmm_obj.n_emission} emissions")
+
+        if self._state_log_prob is None:
+            state_log_prob = self._log_pi + self._log_emission[code]
+        elif self._sparse_transition is not None:
+            best_log_prob, self._backpointers[self.n_observation % len(self._backpointers)] = \
+                self._sparse_transition.viterbi_step(self._state_log_prob)
+            state_log_prob = best_log_prob + self._log_emission[code]
+        else:
+            scores = self._state_log_prob[:, None] + self._log_transition
+            self._backpointers[self.n_observation % len(self._backpointers)] = scores.argmax(axis=0)
+            state_log_prob = scores.max(axis=0) + self._log_emission[code]
+
+        #? Keep the column bounded on unbounded streams, the removed constant is added to the log-likelihood
+        step_max = state_log_prob.max()
+        self._offset += step_max
+        if step_max > -np.inf:
+            state_log_prob -= step_max
+        self._state_log_prob = state_log_prob
+        self.n_observation += 1
+
+        if self.n_observation <= self.lag:
+            return None
+        state = int(state_log_prob.argmax())
+        n_row = len(self._backpointers)
+        for step_idx in range(self.n_observation - 1, self.n_observation - 1 - self.lag, -1):
+            state = self._backpointers[step_idx % n_row, state]
+        return int(state)
+
+    def _backtrack(self, depth: int) -> np.ndarray:
+        """Return the best states of the last depth + 1 steps, from the current step backwards."""
+        states = np.empty(depth + 1, dtype=np.intp)
+        states[0] = self._state_log_prob.argmax()
+        last_idx = self.n_observation - 1
+        for step in range(depth):
+            states[step + 1] = self._backpointers[(last_idx - step) % len(self._backpointers), states[step]]
+        return states
+
+    @property
+    def best_state(self) -> int:
+        """Most likely current state, None before the first observation."""
+        if self._state_log_prob is None:
+            return None
+        return int(self._state_log_prob.argmax())
+
+    @property
+    def log_likelihood(self) -> float:
+        """Log-likelihood of the best path so far, None before the first observation."""
+        if self._state_log_prob is None:
+            return None
+        return float(self._offset + self._state_log_prob.max())
+
+    def flush(self) -> np.ndarray:
+        """
+        Return the states of the steps that are not finalized yet, oldest first.
+
+        With a lag at least as long as the stream, this is the exact Viterbi path of the whole stream.
+
+        Returns:
+            np.ndarray: States of the last min(lag, n_observation) steps.
+        """
+        if self._state_log_prob is None:
+            return np.empty(0, dtype=np.intp)
+        n_pending = min(self.lag, self.n_observation)
+        if n_pending == 0:
+            return np.empty(0, dtype=np.intp)
+        return self._backtrack(n_pending - 1)[::-1].copy()
+
+
+class HMMClassifier:
+    """
+    Bank of Hidden Markov Models with one model per class, scored together for likelihood classification.
+
+    The parameters of all class models are stacked into (n_class, ...) tensors so a sequence is scored
+    against every class in a single forward pass.
 
+    Attributes:
+        n_class (int): Number of classes, one HMM per class.
+        n_emission (int): Number of possible emissions (angle differences).
+        n_state (int): Number of hidden states of each class model.
+        models (list): The per-class HMM objects.
+        class_prior (np.ndarray): Prior probability of each class with shape (n_class,).
+        pi (np.ndarray): Stacked prior probabilities with shape (n_class, n_state).
+        transition (np.ndarray): Stacked transitions with shape (n_class, n_state, n_state).
+        emission (np.ndarray): Stacked emissions with shape (n_class, n_state, n_emission).
+
+    Methods:
+        __init__(n_class, n_emission, n_state): Initialize one HMM per class.
+        fit(samples): Train every class model on the samples of its class.
+        stack_parameters(): Stack the parameters of the class models into tensors.
+        score(observations): Compute the log-likelihood of a sequence under every class model.
+        predict_proba(observations): Compute posterior class probabilities of a sequence.
+        predict(observations): Predict the class of a sequence of observations.
+    """
+    def __init__(self, n_class: int, n_emission: int, n_state: int = 1) -> None:
+        """Initialize the classifier with one HMM per class."""
+        self.n_class = n_class
+        self.n_emission = n_emission
+        self.n_state = n_state
+        self.models = [HMM(n_state=n_state, n_emission=n_emission) for _ in range(n_class)]
+        self.class_prior = np.full(n_class, 1 / n_class, dtype=np.float64)
+        self.stack_parameters()
+
+    def fit(self, samples, random_state=None, **em_kwargs):
+        """
+        Train every class model on the samples of its class.
+
+        Single-state models are fitted by counting. Models with more hidden states start from the class
+        emission histogram, perturbed per state to break the symmetry, and are refined with Baum-Welch.
+
+        Args:
+            samples (list): Samples with "observations" and "label".
+            random_state (int, optional): Seed of the per-state perturbation. Defaults to None.
+            **em_kwargs: Extra keyword arguments forwarded to HMM.fit_em.
+        """
+        class_counts = np.zeros(self.n_class, dtype=np.float64)
+        class_samples = [[] for _ in range(self.n_class)]
+        for sample in samples:
+            class_samples[sample["label"]].append({"observations": sample["observations"], "label": 0})
+            class_counts[sample["label"]] += 1
+
+        rng = np.random.default_rng(random_state)
+        for class_idx, model in enumerate(self.models):
+            histogram = HMM(n_state=1, n_emission=self.n_emission)
+            histogram.fit(class_samples[class_idx])
+            if self.n_state == 1:
+                model.emission = histogram.emission
+                continue
+
+            noise = rng.dirichlet(np.ones(self.n_emission), size=self.n_state)
+            model.emission = 0.9 * histogram.emission + 0.1 * noise
+            model.transition = np.full((self.n_state, self.n_state), 1 / self.n_state, dtype=np.float64)
+            unlabeled = [{"observations": sample["observations"]} for sample in class_samples[class_idx]]
+            model.fit_em(unlabeled, **em_kwargs)
+
+        self.class_prior = class_counts / class_counts.sum()
+        self.stack_parameters()
+
+    def stack_parameters(self):
+        """Stack the parameters of the class models into (n_class, ...) tensors."""
+        self.pi = np.stack([model.pi for model in self.models])
+        self.transition = np.stack([model.transition for model in self.models])
+        self.emission = np.stack([model.emission for model in self.models])
+
+    def score(self, observations: List) -> np.ndarray:
+        """
+        Compute the log-likelihood of a sequence under every class model with the scaled forward algorithm.
+
+        Args:
+            observations (list): List of observations (angle differences).
+
+        Returns:
+            np.ndarray: Log-likelihood of the observations under each class model (n_class,).
+        """
+        observations = self.models[0].encode_observations(observations)
+        log_likelihood = np.zeros(self.n_class, dtype=np.float64)
+
+        #? alpha has shape (n_class, n_state), every class is advanced in the same step
+        alpha = self.pi * self.emission[:, :, observations[0]]
+        for observation_idx in range(len(observations)):
+            if observation_idx > 0:
+                alpha = np.einsum("cs,cst->ct", alpha, self.transition) * self.emission[:, :, observations[observation_idx]]
+            scales = alpha.sum(axis=1)
+            log_likelihood += _log(scales)
+            alpha = alpha / np.where(scales > 0, scales, 1.0)[:, None]
+        return log_likelihood
+
+    def predict_proba(self, observations: List) -> np.ndarray:
+        """
+        Compute posterior class probabilities of a sequence of observations.
+
+        Args:
+            observations (list): List of observations (angle differences).
+
+        Returns:
+            np.ndarray: Posterior probability of each class (n_class,).
+        """
+        log_posterior = self.score(observations) + _log(self.class_prior)
+        if np.isneginf(log_posterior).all():
+            return np.full(self.n_class, 1 / self.n_class, dtype=np.float64)
+        posterior = np.exp(log_posterior - log_posterior.max())
+        return posterior / posterior.sum()
+
+    def predict(self, observations: List):
+        """
+        Predict the class of a sequence of observations.
+
+        Args:
+            observations (list): List of observations (angle differences).
+
+        Returns:
+            tuple: A tuple containing the predicted class and the posterior class probabilities.
+        """
+        posterior = self.predict_proba(observations)
+        return int(posterior.argmax()), posterior
@@ -0,0 +1,187 @@
+import os
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+BACKENDS = ("auto", "numpy", "numba")
+
+
+def resolve_backend(backend: str = "auto") -> str:
+    """
+    Select the kernel backend of the HMM hot loops.
+
+    "auto" uses the HMM_BACKEND environment variable if it is set, otherwise numba when it is installed
+    and NumPy otherwise.
+
+    Args:
+        backend (str, optional): "auto", "numpy" or "numba". Defaults to "auto".
+
+    Returns:
+        str: "numpy" or "numba".
+    """
+    if backend == "auto":
+        backend = os.environ.get("HMM_BACKEND", "numba" if NUMBA_AVAILABLE else "numpy")
+    if backend not in BACKENDS[1:]:
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+    if backend == "numba" and not NUMBA_AVAILABLE:
+        raise ImportError("The numba backend needs the numba package, install it with pip install numba")
+    return backend
+
+
+if NUMBA_AVAILABLE:
+    @numba.njit(parallel=True, cache=True)
+    def _viterbi_kernel(log_pi, log_transition, log_emission, codes, lengths):
+        """Decode every sequence in parallel, argmax ties resolve to the first state like np.argmax."""
+        n_sample, max_length = codes.shape
+        n_state = log_pi.shape[0]
+        paths = np.zeros((n_sample, max_length), dtype=np.intp)
+        scores = np.empty(n_sample, dtype=np.float64)
+        for sample_idx in numba.prange(n_sample):
+            length = max(lengths[sample_idx], 1)
+            backpointers = np.zeros((length, n_state), dtype=np.intp)
+            state_log_prob = np.empty(n_state, dtype=np.float64)
+            step_log_prob = np.empty(n_state, dtype=np.float64)
+            for state in range(n_state):
+                state_log_prob[state] = log_pi[state] + log_emission[state, codes[sample_idx, 0]]
+            for observation_idx in range(1, length):
+                code = codes[sample_idx, observation_idx]
+                for state in range(n_state):
+                    best_state = 0
+                    best_score = state_log_prob[0] + log_transition[0, state]
+                    for previous_state in range(1, n_state):
+                        score = state_log_prob[previous_state] + log_transition[previous_state, state]
+                        if score > best_score:
+                            best_score = score
+                            best_state = previous_state
+                    backpointers[observation_idx, state] = best_state
+                    step_log_prob[state] = best_score + log_emission[state, code]
+                state_log_prob[:] = step_log_prob
+
+            current_state = 0
+            for state in range(1, n_state):
+                if state_log_prob[state] > state_log_prob[current_state]:
+                    current_state = state
+            scores[sample_idx] = state_log_prob[current_state]
+            for observation_idx in range(length - 1, 0, -1):
+                paths[sample_idx, observation_idx] = current_state
+                current_state = backpointers[observation_idx, current_state]
+            paths[sample_idx, 0] = current_state
+        return paths, scores
+
+    @numba.njit(parallel=True, cache=True)
+    def _expectation_kernel(pi, transition, emission, codes, lengths, state_mask):
+        """Compute the Baum-Welch statistics of every sequence in parallel, one row of each accumulator per sequence."""
+        n_sample = codes.shape[0]
+        n_state, n_emission = emission.shape
+        tiny = np.finfo(np.float64).tiny
+        pi_acc = np.zeros((n_sample, n_state), dtype=np.float64)
+        transition_acc = np.zeros((n_sample, n_state, n_state), dtype=np.float64)
+        emission_acc = np.zeros((n_sample, n_state, n_emission), dtype=np.float64)
+        log_likelihood = np.zeros(n_sample, dtype=np.float64)
+        for sample_idx in numba.prange(n_sample):
+            length = lengths[sample_idx]
+            if length == 0:
+                continue
+            step_emission = np.empty((length, n_state), dtype=np.float64)
+            for observation_idx in range(length):
+                for state in range(n_state):
+                    step_emission[observation_idx, state] = (emission[state, codes[sample_idx, observation_idx]]
+                                                             * state_mask[sample_idx, state])
+
+            alpha = np.empty((length, n_state), dtype=np.float64)
+            scales = np.empty(length, dtype=np.float64)
+            for observation_idx in range(length):
+                step_scale = 0.0
+                for state in range(n_state):
+                    if observation_idx == 0:
+                        state_prob = pi[state] * step_emission[0, state]
+                    else:
+                        state_prob = 0.0
+                        for previous_state in range(n_state):
+                            state_prob += alpha[observation_idx - 1, previous_state] * transition[previous_state, state]
+                        state_prob *= step_emission[observation_idx, state]
+                    alpha[observation_idx, state] = state_prob
+                    step_scale += state_prob
+                step_scale = max(step_scale, tiny)
+                scales[observation_idx] = step_scale
+                for state in range(n_state):
+                    alpha[observation_idx, state] /= step_scale
+                log_likelihood[sample_idx] += np.log(step_scale)
+
+            beta = np.ones((length, n_state), dtype=np.float64)
+            next_prob = np.empty(n_state, dtype=np.float64)
+            for observation_idx in range(length - 2, -1, -1):
+                for state in range(n_state):
+                    next_prob[state] = (step_emission[observation_idx + 1, state] * beta[observation_idx + 1, state]
+                                        / scales[observation_idx + 1])
+                for state in range(n_state):
+                    step_beta = 0.0
+                    for next_state in range(n_state):
+                        step_beta += transition[state, next_state] * next_prob[next_state]
+                    beta[observation_idx, state] = step_beta
+                for state in range(n_state):
+                    for next_state in range(n_state):
+                        transition_acc[sample_idx, state, next_state] += (alpha[observation_idx, state]
+                                                                          * transition[state, next_state]
+                                                                          * next_prob[next_state])
+
+            for observation_idx in range(length):
+                code = codes[sample_idx, observation_idx]
+                for state in range(n_state):
+                    gamma = alpha[observation_idx, state] * beta[observation_idx, state]
+                    emission_acc[sample_idx, state, code] += gamma
+                    if observation_idx == 0:
+                        pi_acc[sample_idx, state] = gamma
+        return pi_acc, transition_acc, emission_acc, log_likelihood
+
+
+def viterbi_batch(log_pi, log_transition, log_emission, codes, lengths):
+    """
+    Decode a padded batch of sequences with the compiled Viterbi kernel.
+
+    Args:
+        log_pi (np.ndarray): Log prior probabilities (n_state,).
+        log_transition (np.ndarray): Log transition probabilities (n_state, n_state).
+        log_emission (np.ndarray): Log emission probabilities (n_state, n_emission).
+        codes (np.ndarray): Padded emission codes clipped to valid indexes (n_sample, max_length).
+        lengths (np.ndarray): Valid length of each sequence (n_sample,).
+
+    Returns:
+        tuple: State paths (n_sample, max_length), zero after each sequence, and Viterbi log-likelihoods (n_sample,).
+    """
+    return _viterbi_kernel(np.ascontiguousarray(log_pi, dtype=np.float64),
+                           np.ascontiguousarray(log_transition, dtype=np.float64),
+                           np.ascontiguousarray(log_emission, dtype=np.float64),
+                           np.ascontiguousarray(codes, dtype=np.intp),
+                           np.ascontiguousarray(lengths, dtype=np.intp))
+
+
+def expectation_batch(pi, transition, emission, codes, lengths, state_mask=None):
+    """
+    Compute the Baum-Welch sufficient statistics of a padded batch with the compiled kernel.
+
+    Args:
+        pi (np.ndarray): Prior probabilities (n_state,).
+        transition (np.ndarray): Transition probabilities (n_state, n_state).
+        emission (np.ndarray): Emission probabilities (n_state, n_emission).
+        codes (np.ndarray): Padded emission codes clipped to valid indexes (n_sample, max_length).
+        lengths (np.ndarray): Valid length of each sequence (n_sample,).
+        state_mask (np.ndarray, optional): Allowed states of each sequence (n_sample, n_state).
+
+    Returns:
+        tuple: Same statistics as hmm.expectation_step.
+    """
+    if state_mask is None:
+        state_mask = np.ones((codes.shape[0], emission.shape[0]), dtype=np.float64)
+    pi_acc, transition_acc, emission_acc, log_likelihood = _expectation_kernel(
+        np.ascontiguousarray(pi, dtype=np.float64),
+        np.ascontiguousarray(transition, dtype=np.float64),
+        np.ascontiguousarray(emission, dtype=np.float64),
+        np.ascontiguousarray(codes, dtype=np.intp),
+        np.ascontiguousarray(lengths, dtype=np.intp),
+        np.ascontiguousarray(state_mask, dtype=np.float64))
+    return pi_acc.sum(axis=0), transition_acc.sum(axis=0), emission_acc.sum(axis=0), float(log_likelihood.sum())
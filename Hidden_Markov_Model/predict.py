@@ -27,18 +27,20 @@ def main(args):
     pp = utils.Preprocess(n_emission=config.n_emission)
 
     #? Load the trained HMM model
-    hmm_obj = HMM(n_state=config.n_state, n_emission=config.n_emission)
+    hmm_obj = HMM(n_state=config.n_state, n_emission=config.n_emission, backend=getattr(config, "backend", "auto"))
     hmm_obj.load()
     print(hmm_obj)
 
-    #? Get a sample image and preprocess it
-    status, sample = create_dataset.get_sample(img_path=args.img_path, n_observations=config.n_observations)
+    #? Read the image once and preprocess it in memory
+    img = cv2.imread(args.img_path)
+    status, sample = create_dataset.get_sample(img, n_observations=config.n_observations,
+                                               contour_method=getattr(config, "contour_method", "canny"),
+                                               sampling=getattr(config, "sampling", "index"))
     if status:
         sample = pp.preprocess_single_sample(sample=sample)
         winner_class, state_vote = hmm_obj.predict(observations=sample["observations"])
 
         #? Visualize image and prediction
-        img = cv2.imread(args.img_path)
         cv2.putText(img, f"Prediction: {config.classes[winner_class]}", (20, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,0), 2)
         cv2.putText(img, f"State_vote: {state_vote}", (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0,0,0), 2)
         basename = os.path.basename(args.img_path)
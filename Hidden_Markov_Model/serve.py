@@ -0,0 +1,331 @@
+import sys
+import json
+import time
+import queue
+import base64
+import argparse
+import threading
+import socketserver
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import cv2
+import yaml
+import utils
+import create_dataset
+from hmm import HMM
+
+#? Queued by MicroBatcher.stop to end the batching loop
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    Collect concurrent prediction requests into batches for HMM.predict_batch.
+
+    A background thread waits for the first request, then keeps collecting requests until max_batch_size
+    is reached or max_delay seconds have passed, and decodes them with a single batched call. The thread is
+    not a daemon, stop must be called so it can finish the queued requests before the interpreter exits.
+
+    Attributes:
+        hmm_obj (HMM): The trained model.
+        max_batch_size (int): Maximum number of sequences per batch.
+        max_delay (float): Maximum time in seconds a request waits for other requests.
+
+    Methods:
+        __init__(hmm_obj, max_batch_size, max_delay): Start the batching thread.
+        submit(observations): Queue a sequence of observation codes for prediction.
+        stop(timeout): Finish the queued requests and stop the batching thread.
+    """
+    def __init__(self, hmm_obj: HMM, max_batch_size: int = 256, max_delay: float = 0.002) -> None:
+        """Start the batching thread."""
+        self.hmm_obj = hmm_obj
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="MicroBatcher")
+        self._thread.start()
+
+    def submit(self, observations: np.ndarray) -> Future:
+        """
+        Queue a sequence of observation codes for prediction.
+
+        Requests are validated here, so an invalid one is rejected before it can join a batch.
+
+        Args:
+            observations (np.ndarray): Emission codes of one sample.
+
+        Returns:
+            Future: Resolves to a (winner_class, score, state_votes, batch_size) tuple.
+        """
+        observations = np.asarray(observations)
+        if observations.ndim != 1 or len(observations) == 0 or not np.issubdtype(observations.dtype, np.integer):
+            raise ValueError("observations must be a non-empty sequence of integer emission codes")
+        if observations.min() < 0 or observations.max() >= self.hmm_obj.n_emission:
+            raise ValueError(f"observation codes must be in [0, {self.hmm_obj.n_emission})")
+        future = Future()
+        self._requests.put((observations, future))
+        return future
+
+    def stop(self, timeout: float = None):
+        """Finish the queued requests and stop the batching thread, waiting at most timeout seconds."""
+        self._requests.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        """Batching loop of the background thread."""
+        stopping = False
+        while not stopping:
+            request = self._requests.get()
+            if request is _STOP:
+                return
+            batch = [request]
+            deadline = time.perf_counter() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    stopping = True
+                    break
+                batch.append(request)
+
+            self._predict(batch)
+
+    def _predict(self, batch):
+        """Decode a batch of requests and resolve their futures."""
+        try:
+            classes, scores, votes = self.hmm_obj.predict_batch([observations for observations, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            #? Decode the requests one by one, so a failing request only fails its own future
+            for request in batch:
+                self._predict([request])
+            return
+        for idx, (_, future) in enumerate(batch):
+            future.set_result((int(classes[idx]), float(scores[idx]), votes[idx], len(batch)))
+
+
+class InferenceService:
+    """
+    HMM shape classifier kept warm in memory for repeated requests.
+
+    Attributes:
+        config (utils.Config): Configuration of the model.
+        pp (utils.Preprocess): Preprocessing object.
+        hmm_obj (HMM): The trained model, loaded once.
+        batcher (MicroBatcher): Micro-batcher used for every prediction.
+
+    Methods:
+        __init__(config, model_path, max_batch_size, max_delay): Load the model once and warm it up.
+        close(): Stop the micro-batcher.
+        predict_points(points): Classify a sample given its contour points.
+        predict_image(image_bytes): Classify an encoded image.
+        handle(request): Classify the sample of a JSON request.
+    """
+    def __init__(self, config: utils.Config, model_path: str, max_batch_size: int = 256, max_delay: float = 0.002) -> None:
+        """Load the model once and warm it up."""
+        self.config = config
+        self.pp = utils.Preprocess(n_emission=config.n_emission)
+        self.hmm_obj = HMM(n_state=config.n_state, n_emission=config.n_emission, backend=getattr(config, "backend", "auto"))
+        self.hmm_obj.load(model_path, mmap=True)
+        #? A dummy batch compiles the numba kernels now instead of during the first request
+        self.hmm_obj.predict_batch(np.zeros((1, config.n_observations), dtype=self.pp.code_dtype))
+        self.batcher = MicroBatcher(self.hmm_obj, max_batch_size=max_batch_size, max_delay=max_delay)
+
+    def close(self):
+        """Stop the micro-batcher, the process can only exit once its thread is stopped."""
+        self.batcher.stop()
+
+    def predict_points(self, points, start: float = None) -> dict:
+        """
+        Classify a sample given its contour points.
+
+        Args:
+            points (list or np.ndarray): Contour points with shape (n_points, 2).
+            start (float, optional): perf_counter value when the request started. Defaults to now.
+
+        Returns:
+            dict: Predicted class, class name, state votes, score and timings in milliseconds.
+        """
+        start = time.perf_counter() if start is None else start
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] != 2 or len(points) < 2:
+            raise ValueError("points must be a list of at least two [x, y] pairs")
+        observations = self.pp.quantize_observation(self.pp.extract_observations_batch(points[None])[0])
+        preprocessed = time.perf_counter()
+
+        winner_class, score, votes, batch_size = self.batcher.submit(observations).result()
+        done = time.perf_counter()
+        return {
+            "class": winner_class,
+            "class_name": self.config.classes[winner_class],
+            "state_vote": {state_idx: int(vote) for state_idx, vote in enumerate(votes)},
+            "score": score,
+            "batch_size": batch_size,
+            "timing_ms": {
+                "preprocess": (preprocessed - start) * 1000,
+                "predict": (done - preprocessed) * 1000,
+                "total": (done - start) * 1000,
+            },
+        }
+
+    def predict_image(self, image_bytes: bytes) -> dict:
+        """
+        Classify an encoded image (PNG, JPEG, ...).
+
+        Args:
+            image_bytes (bytes): Encoded image.
+
+        Returns:
+            dict: Prediction, see predict_points.
+        """
+        start = time.perf_counter()
+        if not image_bytes:
+            raise ValueError("empty image")
+        img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("could not decode image")
+        status, sample = create_dataset.get_sample(img, n_observations=self.config.n_observations,
+                                                   contour_method=getattr(self.config, "contour_method", "canny"),
+                                                   sampling=getattr(self.config, "sampling", "index"))
+        if not status:
+            raise ValueError("no contour found in image")
+        return self.predict_points(sample["points"], start=start)
+
+    def handle(self, request: dict) -> dict:
+        """
+        Classify the sample of a JSON request.
+
+        Args:
+            request (dict): Either {"points": [[x, y], ...]} or {"image": "<base64 encoded image>"}.
+
+        Returns:
+            dict: Prediction, see predict_points.
+        """
+        if "points" in request:
+            return self.predict_points(request["points"])
+        if "image" in request:
+            return self.predict_image(base64.b64decode(request["image"]))
+        raise ValueError("request must contain 'points' or 'image'")
+
+    def handle_line(self, line: str) -> str:
+        """Answer one line of the JSON line protocol, errors are returned as {"error": message}."""
+        try:
+            response = self.handle(json.loads(line))
+        except (ValueError, KeyError, TypeError) as e:
+            response = {"error": str(e)}
+        return json.dumps(response)
+
+
+class InferenceHTTPServer(ThreadingHTTPServer):
+    """Threading HTTP server with a listen backlog large enough for bursts of concurrent clients."""
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_http_handler(service: InferenceService, max_body_bytes: int = 16 * 2**20):
+    """Create an HTTP request handler class bound to a service, bodies above max_body_bytes are rejected with 413."""
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok"})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._reply(404, {"error": "not found"})
+                return
+            try:
+                content_length = int(self.headers.get("Content-Length", 0))
+                if content_length < 0:
+                    raise ValueError("invalid Content-Length")
+                if content_length > max_body_bytes:
+                    #? The body is never read, so the connection cannot be reused
+                    self.close_connection = True
+                    self._reply(413, {"error": f"request body exceeds {max_body_bytes} bytes"})
+                    return
+                body = self.rfile.read(content_length)
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    response = service.handle(json.loads(body))
+                else:
+                    response = service.predict_image(body)
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            self._reply(200, response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_unix_handler(service: InferenceService):
+    """Create a Unix socket handler class answering the JSON line protocol."""
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    self.wfile.write((service.handle_line(line.decode(errors="replace")) + "\n").encode())
+                    self.wfile.flush()
+
+    return Handler
+
+
+def main(args):
+    with open(args.cfg, "r") as f:
+        config_data = yaml.load(f, Loader=yaml.FullLoader)
+    config = utils.Config(**config_data)
+
+    service = InferenceService(config, model_path=args.model, max_batch_size=args.max_batch_size,
+                               max_delay=args.max_delay_ms / 1000)
+
+    try:
+        if args.stdio:
+            #? Line protocol fallback, one JSON request per line on stdin and one JSON response per line on stdout
+            for line in sys.stdin:
+                if line.strip():
+                    sys.stdout.write(service.handle_line(line) + "\n")
+                    sys.stdout.flush()
+        elif args.unix:
+            with socketserver.ThreadingUnixStreamServer(args.unix, make_unix_handler(service)) as server:
+                print(f"Serving on unix socket {args.unix}", file=sys.stderr)
+                server.serve_forever()
+        else:
+            with InferenceHTTPServer((args.host, args.port), make_http_handler(service, args.max_body_bytes)) as server:
+                print(f"Serving on http://{args.host}:{args.port}/predict", file=sys.stderr)
+                server.serve_forever()
+    finally:
+        #? Runs on stdin EOF and on server shutdown (Ctrl+C), the batching thread would otherwise keep the process alive
+        service.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, default='config.yaml', help='config.yaml path')
+    parser.add_argument('--model', type=str, default='model.hmm', help='trained HMM model path')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='HTTP host')
+    parser.add_argument('--port', type=int, default=8000, help='HTTP port')
+    parser.add_argument('--unix', type=str, default=None, help='serve the JSON line protocol on this unix socket path')
+    parser.add_argument('--stdio', action='store_true', help='serve the JSON line protocol on stdin/stdout')
+    parser.add_argument('--max-batch-size', type=int, default=256, help='maximum number of requests per batch')
+    parser.add_argument('--max-delay-ms', type=float, default=2.0, help='maximum time a request waits to be batched')
+    parser.add_argument('--max-body-bytes', type=int, default=16 * 2**20, help='largest accepted HTTP request body, larger ones get 413')
+    args = parser.parse_args()
+    main(args)
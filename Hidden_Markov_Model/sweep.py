@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import yaml
+import argparse
+import numpy as np
+from rich import print
+from rich.table import Table
+import utils
+import create_dataset
+from contour_store import ContourStore, SAMPLING_METHODS
+from hmm import HMM
+
+#? Contour features of the current n_observations, set once per worker process by init_worker
+_FEATURES = None
+_LABELS = None
+
+
+def load_contour_store(config: utils.Config, store_path: str, rebuild: bool = False) -> ContourStore:
+    """
+    Load the full contour store of the train part, extracting the contours first if it is missing, stale or
+    rebuild is True.
+
+    Args:
+        config (utils.Config): Configuration with "dataset_dir", "classes", "n_jobs" and "chunk_size".
+        store_path (str): Path of the contour store, create_dataset.py writes it to {dataset_dir}/contours_train.npz.
+        rebuild (bool, optional): Re-extract the contours even if the store exists. Defaults to False.
+
+    Returns:
+        ContourStore: Full contours and labels of the train part.
+    """
+    contour_method = getattr(config, "contour_method", "canny")
+    if not rebuild and os.path.isfile(store_path):
+        store = ContourStore.load(store_path)
+        if store.contour_method == contour_method:
+            return store
+
+    img_paths, labels = create_dataset.list_images(config.dataset_dir, "train", config.classes)
+    store, failed = create_dataset.build_part(img_paths, labels, n_jobs=config.n_jobs, chunk_size=config.chunk_size,
+                                              desc="Extract contours: ", contour_method=contour_method)
+    for img_path, error in failed:
+        print(f"[red]Failed[/red] {img_path}: {error}")
+    store.save(store_path)
+    return store
+
+
+def make_folds(labels: np.ndarray, n_folds: int, seed: int = 0):
+    """
+    Split the sample indexes into stratified cross-validation folds.
+
+    Args:
+        labels (np.ndarray): Class id of every sample.
+        n_folds (int): Number of folds.
+        seed (int, optional): Seed of the shuffle. Defaults to 0.
+
+    Returns:
+        list: Test indexes of every fold.
+    """
+    rng = np.random.default_rng(seed)
+    folds = [[] for _ in range(n_folds)]
+    for class_id in np.unique(labels):
+        class_idxs = rng.permutation(np.flatnonzero(labels == class_id))
+        for fold, fold_idxs in enumerate(np.array_split(class_idxs, n_folds)):
+            folds[fold].append(fold_idxs)
+    return [np.sort(np.concatenate(fold_idxs)) for fold_idxs in folds]
+
+
+def init_worker(features: np.ndarray, labels: np.ndarray):
+    """Keep the features and labels in the worker, so jobs only carry the fold indexes, and warm up the kernels."""
+    global _FEATURES, _LABELS
+    _FEATURES = features
+    _LABELS = labels
+
+    #? A tiny fit and predict compiles the numba kernels here, so the JIT is not timed in the first fold
+    codes = np.array([[0, 1], [1, 0]], dtype=utils.Preprocess().code_dtype)
+    hmm_obj = HMM(n_state=2, n_emission=2)
+    hmm_obj.fit_batches([(codes, np.array([0, 1]))])
+    hmm_obj.predict_batch(codes)
+
+
+def evaluate_fold(n_state: int, n_emission: int, test_idxs: np.ndarray):
+    """
+    Train on every sample outside a fold and compute the accuracy on the fold.
+
+    Args:
+        n_state (int): Number of hidden states.
+        n_emission (int): Number of emissions.
+        test_idxs (np.ndarray): Indexes of the samples of the fold.
+
+    Returns:
+        dict: Accuracy, fit seconds and predict seconds.
+    """
+    pp = utils.Preprocess(n_emission=n_emission)
+    observations = pp.quantize_observation(_FEATURES)
+    train_mask = np.ones(len(_LABELS), dtype=bool)
+    train_mask[test_idxs] = False
+
+    start = time.perf_counter()
+    hmm_obj = HMM(n_state=n_state, n_emission=n_emission)
+    hmm_obj.fit_batches([(observations[train_mask], _LABELS[train_mask])])
+    fitted = time.perf_counter()
+    y_pred = hmm_obj.predict_batch(observations[test_idxs])[0]
+    done = time.perf_counter()
+    return {
+        "accuracy": float((y_pred == _LABELS[test_idxs]).mean()),
+        "fit_seconds": fitted - start,
+        "predict_seconds": done - fitted,
+    }
+
+
+def run_sweep(config: utils.Config, store: ContourStore, n_observations_grid: list, n_emission_grid: list, n_folds: int,
+              sampling: str = "index"):
+    """
+    Cross-validate every (n_observations, n_emission) pair over a process pool.
+
+    Args:
+        config (utils.Config): Configuration with "n_state", "n_jobs" and "seed".
+        store (ContourStore): Full contours and labels of the train part.
+        n_observations_grid (list): Values of n_observations to try.
+        n_emission_grid (list): Values of n_emission to try.
+        n_folds (int): Number of cross-validation folds.
+        sampling (str, optional): Contour point sampling, "index" or "arc_length". Defaults to "index".
+
+    Returns:
+        list: One result dict per (n_observations, n_emission) pair with the per-fold accuracies.
+    """
+    labels = store.labels
+    folds = make_folds(labels, n_folds, seed=getattr(config, "seed", 0))
+    pp = utils.Preprocess()
+    results = []
+    for n_observations in n_observations_grid:
+        #? Features do not depend on n_emission, they are computed once per n_observations and sent once per worker
+        features = pp.extract_observations_batch(store.resample(n_observations, method=sampling))
+        tasks = (((n_emission, fold), (config.n_state, n_emission, test_idxs))
+                 for n_emission in n_emission_grid for fold, test_idxs in enumerate(folds))
+        fold_results = {}
+        with utils.process_pool(config.n_jobs, initializer=init_worker, initargs=(features, labels)) as executor:
+            for key, fold_result in utils.bounded_map(executor, evaluate_fold, tasks, max_in_flight=2 * config.n_jobs):
+                fold_results[key] = fold_result
+
+        for n_emission in n_emission_grid:
+            accuracies = [fold_results[(n_emission, fold)]["accuracy"] for fold in range(n_folds)]
+            results.append({
+                "n_observations": n_observations,
+                "n_emission": n_emission,
+                "sampling": sampling,
+                "accuracies": accuracies,
+                "mean_accuracy": float(np.mean(accuracies)),
+                "std_accuracy": float(np.std(accuracies)),
+                "fit_seconds": float(np.mean([fold_results[(n_emission, fold)]["fit_seconds"] for fold in range(n_folds)])),
+                "predict_seconds": float(np.mean([fold_results[(n_emission, fold)]["predict_seconds"] for fold in range(n_folds)])),
+            })
+    return results
+
+
+def print_results(results: list, n_folds: int, sampling: str = "index"):
+    """Print the sweep results as a table, best mean accuracy first."""
+    table = Table(title=f"{n_folds}-fold cross-validation, {sampling} sampling")
+    for column in ["n_observations", "n_emission", "accuracy", "fit ms", "predict ms"]:
+        table.add_column(column, justify="right")
+    results = sorted(results, key=lambda result: -result["mean_accuracy"])
+    for rank, result in enumerate(results):
+        table.add_row(str(result["n_observations"]),
+                      str(result["n_emission"]),
+                      f"{result['mean_accuracy']:.4f} ± {result['std_accuracy']:.4f}",
+                      f"{result['fit_seconds'] * 1000:.2f}",
+                      f"{result['predict_seconds'] * 1000:.2f}",
+                      style="bold green" if rank == 0 else None)
+    print(table)
+
+
+def main(args):
+    with open(args.cfg, "r") as f:
+        config_data = yaml.load(f, Loader=yaml.FullLoader)
+    config = utils.Config(**config_data)
+
+    store_path = args.store or create_dataset.contour_store_path(config.dataset_dir, "train")
+    store = load_contour_store(config, store_path, rebuild=args.rebuild_store)
+    print(f"{len(store)} cached contours, {len(store.contour_points)} points")
+
+    sampling = args.sampling or getattr(config, "sampling", "index")
+    results = run_sweep(config, store,
+                        n_observations_grid=args.n_observations,
+                        n_emission_grid=args.n_emission,
+                        n_folds=args.folds,
+                        sampling=sampling)
+    print_results(results, args.folds, sampling=sampling)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cfg', type=str, default='config.yaml', help='config.yaml path')
+    parser.add_argument('--n-observations', type=int, nargs='+', default=[4, 8, 16, 32], help='values of n_observations to try')
+    parser.add_argument('--n-emission', type=int, nargs='+', default=[5, 10, 20, 40], help='values of n_emission to try')
+    parser.add_argument('--folds', type=int, default=5, help='number of cross-validation folds')
+    parser.add_argument('--sampling', type=str, default=None, choices=SAMPLING_METHODS, help='contour point sampling, defaults to the config value')
+    parser.add_argument('--store', type=str, default=None, help='contour store path, defaults to {dataset_dir}/contours_train.npz')
+    parser.add_argument('--rebuild-store', action='store_true', help='re-extract the contours even if the store exists')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON results path')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,135 @@
+import math
+import numpy as np
+import pytest
+import utils
+import kernels
+from hmm import HMM, pad_observations, expectation_step
+from benchmark import make_synthetic_points
+
+
+N_SAMPLES = 1000
+N_POINTS = 64
+N_EMISSION = 10
+SEED = 0
+
+
+def make_observations(n_samples: int = N_SAMPLES, n_points: int = N_POINTS, n_emission: int = N_EMISSION):
+    """Return quantized synthetic observations (n_samples, n_points) and labels (n_samples,)."""
+    points, labels = make_synthetic_points(n_samples, n_points, seed=SEED)
+    pp = utils.Preprocess(n_emission=n_emission)
+    return pp.quantize_observation(pp.extract_observations_batch(points)), labels
+
+
+def reference_observations(points) -> np.ndarray:
+    """Angle differences of one contour computed point by point with math.atan2, the original scalar path."""
+    angles = []
+    for i in range(len(points)):
+        x0, y0 = points[i]
+        x1, y1 = points[(i + 1) % len(points)]
+        angle = math.atan2(y1 - y0, x1 - x0) * 180 / np.pi
+        angles.append(angle + 360 if angle < 0 else angle)
+
+    diff_angles = []
+    for i in range(len(angles)):
+        diff = angles[i] - angles[(i + 1) % len(angles)]
+        if diff < 0:
+            diff += 360
+        if diff > 180:
+            diff -= 180
+        diff_angles.append(diff)
+    return np.array(diff_angles)
+
+
+def test_features_match_scalar_reference():
+    rng = np.random.default_rng(SEED)
+    #? Small integer contours produce repeated points, collinear steps and U-turns
+    points = rng.integers(0, 4, size=(N_SAMPLES, N_POINTS, 2))
+    points[: N_SAMPLES // 4, 1::2] = points[: N_SAMPLES // 4, 0:1]
+    expected = np.stack([reference_observations(sample_points) for sample_points in points])
+
+    actual = utils.Preprocess().extract_observations_batch(points)
+    np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9)
+    for n_emission in (2, 4, 10, 20, 45, 90, 180):
+        pp = utils.Preprocess(n_emission=n_emission)
+        np.testing.assert_array_equal(pp.quantize_observation(actual), pp.quantize_observation(expected))
+
+
+@pytest.mark.skipif(not kernels.NUMBA_AVAILABLE, reason="numba is not installed")
+def test_backends_match():
+    observations, labels = make_observations()
+    #? Ragged lengths exercise the padding of the batched paths
+    lengths = np.random.default_rng(SEED).integers(1, N_POINTS + 1, size=N_SAMPLES)
+    models = {}
+    for backend in ("numpy", "numba"):
+        models[backend] = HMM(n_state=2, n_emission=N_EMISSION, backend=backend)
+        models[backend].fit_batches([(observations, labels)])
+
+    reference = models["numpy"].predict_batch(observations, lengths)
+    compiled = models["numba"].predict_batch(observations, lengths)
+    for expected, actual in zip(reference, compiled):
+        np.testing.assert_array_equal(actual, expected)
+    for sample_observations in observations[:100]:
+        np.testing.assert_array_equal(models["numba"].viterbi(sample_observations)[0],
+                                      models["numpy"].viterbi(sample_observations)[0])
+
+    #? The kernels sum in a different order, the Baum-Welch statistics only agree up to rounding
+    hmm_obj = models["numpy"]
+    padded, lengths = pad_observations(observations, lengths)
+    for mask in (None, np.eye(2)[labels]):
+        expected = expectation_step(hmm_obj.pi, hmm_obj.transition, hmm_obj.emission, padded, lengths, mask)
+        actual = kernels.expectation_batch(hmm_obj.pi, hmm_obj.transition, hmm_obj.emission, padded, lengths, mask)
+        for expected_stat, actual_stat in zip(expected, actual):
+            np.testing.assert_allclose(actual_stat, expected_stat, rtol=1e-10, atol=0)
+
+
+@pytest.mark.parametrize("dtype", ["float64", "int8"])
+def test_partial_fit_after_load(tmp_path, dtype):
+    observations, labels = make_observations()
+    samples = [{"observations": sample_observations, "label": label} for sample_observations, label in zip(observations, labels)]
+    half = N_SAMPLES // 2
+    reference = HMM(n_state=2, n_emission=N_EMISSION)
+    reference.fit(samples)
+
+    hmm_obj = HMM(n_state=2, n_emission=N_EMISSION)
+    hmm_obj.fit(samples[:half])
+    path = str(tmp_path / "model.hmm")
+    hmm_obj.save(path, dtype=dtype)
+    loaded = HMM(n_state=2, n_emission=N_EMISSION)
+    loaded.load(path, mmap=True)
+    loaded.partial_fit(samples[half:])
+    for name in ("pi", "transition", "emission"):
+        np.testing.assert_allclose(getattr(loaded, name), getattr(reference, name))
+
+
+def test_partial_fit_after_fit_em():
+    observations, labels = make_observations()
+    samples = [{"observations": sample_observations, "label": label} for sample_observations, label in zip(observations, labels)]
+    hmm_obj = HMM(n_state=2, n_emission=N_EMISSION)
+    hmm_obj.fit_em(samples, n_iter=5, random_state=SEED)
+    trained = {name: np.array(getattr(hmm_obj, name)) for name in ("pi", "transition", "emission")}
+    hmm_obj.partial_fit([])
+    for name, expected in trained.items():
+        np.testing.assert_allclose(getattr(hmm_obj, name), expected)
+
+
+@pytest.mark.parametrize("backend", ["numpy", "numba"])
+def test_predict_empty(backend):
+    if backend == "numba" and not kernels.NUMBA_AVAILABLE:
+        pytest.skip("numba is not installed")
+    observations, labels = make_observations(n_samples=10)
+    hmm_obj = HMM(n_state=2, n_emission=N_EMISSION, backend=backend)
+    hmm_obj.fit_batches([(observations, labels)])
+
+    for batch in ([], np.zeros((0, N_POINTS), dtype=np.intp)):
+        classes, scores, votes = hmm_obj.predict_batch(batch)
+        assert classes.shape == (0,) and scores.shape == (0,) and votes.shape == (0, 2)
+    with pytest.raises(ValueError):
+        hmm_obj.predict([])
+
+
+def test_fit_em_without_sequences_keeps_pi():
+    hmm_obj = HMM(n_state=2, n_emission=N_EMISSION)
+    pi = np.array([0.25, 0.75])
+    hmm_obj.pi = pi
+    hmm_obj.fit_em([], n_iter=1)
+    np.testing.assert_array_equal(hmm_obj.pi, pi)
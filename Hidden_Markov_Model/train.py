@@ -1,6 +1,7 @@
 import os
 import yaml
 import argparse
+import numpy as np
 from rich import print
 from sklearn.metrics import accuracy_score, confusion_matrix
 import utils
@@ -14,21 +15,40 @@ def main(args):
     config = utils.Config(**config_data)
     print(config)
 
-    data_path = os.path.join(config.dataset_dir, "data.npz")
+    if getattr(config, "dataset_format", "npz") == "shards":
+        data_path = os.path.join(config.dataset_dir, "shards")
+    else:
+        data_path = os.path.join(config.dataset_dir, "data.npz")
     pp = utils.Preprocess(n_emission=config.n_emission)
     pp(data_path=data_path)
 
-    hmm_obj = HMM(n_state=config.n_state, n_emission=config.n_emission)
-    hmm_obj.fit(samples=pp.train_samples)
-    hmm_obj.save()
+    hmm_obj = HMM(n_state=config.n_state, n_emission=config.n_emission, backend=getattr(config, "backend", "auto"))
+    if getattr(config, "fit_method", "count") == "em":
+        if pp.train_dataset is not None:
+            #? Every EM iteration streams the memory-mapped shards again, only the statistics are kept in memory
+            hmm_obj.fit_em_batches(lambda: pp.iter_observations(pp.train_dataset),
+                                   n_iter=config.em_n_iter, tol=config.em_tol, n_jobs=config.n_jobs)
+        else:
+            hmm_obj.fit_em(samples=pp.train_samples, n_iter=config.em_n_iter, tol=config.em_tol, n_jobs=config.n_jobs)
+        print(f"log-likelihood trace={hmm_obj.log_likelihood_trace}")
+    elif pp.train_dataset is not None:
+        hmm_obj.fit_batches(pp.iter_observations(pp.train_dataset))
+    else:
+        hmm_obj.fit(samples=pp.train_samples)
+    hmm_obj.save(dtype=getattr(config, "model_dtype", "float64"))
     print(hmm_obj)
 
-    y_pred = []
-    y_true = []
-    for sample in pp.test_samples:
-        winner_class, state_vote = hmm_obj.predict(observations=sample["observations"])
-        y_pred.append(winner_class)
-        y_true.append(sample["label"])
+    if pp.test_dataset is not None:
+        y_true = []
+        y_pred = []
+        for observations, labels in pp.iter_observations(pp.test_dataset):
+            y_true.append(labels)
+            y_pred.append(hmm_obj.predict_batch(observations=observations)[0])
+        y_true = np.concatenate(y_true)
+        y_pred = np.concatenate(y_pred)
+    else:
+        y_true = pp.test_labels
+        y_pred, scores, state_votes = hmm_obj.predict_batch(observations=pp.test_observations)
 
     acc = accuracy_score(y_true=y_true, y_pred=y_pred)
     print(f"accuracy={acc}")
@@ -0,0 +1,182 @@
+import numpy as np
+
+
+def _reduce_groups(ufunc, values: np.ndarray, starts: np.ndarray, nonempty: np.ndarray, fill: float) -> np.ndarray:
+    """Reduce consecutive groups of the last axis with ufunc.reduceat, empty groups get fill."""
+    reduced = ufunc.reduceat(values, starts, axis=-1)
+    if len(starts) == len(nonempty):
+        return reduced
+    result = np.full(values.shape[:-1] + (len(nonempty),), fill, dtype=reduced.dtype)
+    result[..., nonempty] = reduced
+    return result
+
+
+class SparseTransition:
+    """
+    Sparse transition matrix for HMMs with many states and few allowed transitions.
+
+    Nonzero entries are stored in compressed sparse column order: the entries of destination state j are
+    sources[indptr[j]:indptr[j + 1]] with probabilities data[indptr[j]:indptr[j + 1]], sources ascending.
+    Every step of Viterbi, forward and backward costs O(nnz) instead of O(n_state^2).
+
+    Products with NumPy arrays use the matrix product operator, so code written for a dense transition
+    array (alpha @ transition, transition @ beta) also works with a SparseTransition.
+
+    Attributes:
+        n_state (int): Number of states.
+        indptr (np.ndarray): Start of the entries of every destination state, with nnz appended (n_state + 1,).
+        sources (np.ndarray): Source state of every entry (nnz,).
+        data (np.ndarray): Transition probability of every entry (nnz,).
+        log_data (np.ndarray): Log transition probability of every entry (nnz,).
+        destinations (np.ndarray): Destination state of every entry (nnz,).
+
+    Methods:
+        __init__(n_state, indptr, sources, data): Initialize the matrix from its compressed arrays.
+        from_dense(matrix): Keep the nonzero entries of a dense matrix.
+        identity(n_state): Identity transitions.
+        left_to_right(n_state, self_prob, max_jump): Banded left-to-right transitions.
+        nnz: Number of stored entries.
+        to_dense(): Convert to a dense (n_state, n_state) array.
+        with_data(data): Same sparsity structure with other entries.
+        T: Transposed matrix, computed once.
+        viterbi_step(state_log_prob): Best previous state and score of every state.
+    """
+    #? Make NumPy defer "array @ SparseTransition" to __rmatmul__ instead of building an object array
+    __array_ufunc__ = None
+
+    def __init__(self, n_state: int, indptr: np.ndarray, sources: np.ndarray, data: np.ndarray) -> None:
+        """Initialize the matrix from its compressed arrays."""
+        self.n_state = n_state
+        self.indptr = np.asarray(indptr, dtype=np.intp)
+        self.sources = np.asarray(sources, dtype=np.intp)
+        self.data = np.asarray(data, dtype=np.float64)
+        if len(self.indptr) != n_state + 1 or self.indptr[-1] != len(self.sources) or len(self.sources) != len(self.data):
+            raise ValueError("indptr, sources and data do not describe a sparse matrix")
+        if len(self.data) == 0:
+            raise ValueError("A transition matrix needs at least one nonzero entry")
+
+        with np.errstate(divide="ignore"):
+            self.log_data = np.log(self.data)
+        counts = np.diff(self.indptr)
+        self.destinations = np.repeat(np.arange(n_state), counts)
+        #? reduceat only gets the starts of nonempty groups, each group then ends where the next one starts
+        self._nonempty = counts > 0
+        self._starts = self.indptr[:-1][self._nonempty]
+        self._positions = np.arange(self.nnz)
+
+        #? Entries grouped by source, for the products with a vector on the right
+        self._by_source = np.argsort(self.sources, kind="stable")
+        source_counts = np.bincount(self.sources, minlength=n_state)
+        self._source_nonempty = source_counts > 0
+        self._source_starts = (np.cumsum(source_counts) - source_counts)[self._source_nonempty]
+        self._transpose = None
+
+    @classmethod
+    def from_dense(cls, matrix: np.ndarray) -> "SparseTransition":
+        """Keep the nonzero entries of a dense (n_state, n_state) transition matrix."""
+        matrix = np.asarray(matrix, dtype=np.float64)
+        destinations, sources = np.nonzero(matrix.T)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(destinations, minlength=matrix.shape[0]))])
+        return cls(matrix.shape[0], indptr, sources, matrix[sources, destinations])
+
+    @classmethod
+    def identity(cls, n_state: int) -> "SparseTransition":
+        """Identity transitions, every state stays in itself."""
+        return cls(n_state, np.arange(n_state + 1), np.arange(n_state), np.ones(n_state))
+
+    @classmethod
+    def left_to_right(cls, n_state: int, self_prob: float = 0.5, max_jump: int = 1) -> "SparseTransition":
+        """
+        Banded left-to-right transitions, as used for stroke and contour models.
+
+        State i stays in itself with probability self_prob and moves to one of the next max_jump states
+        with equal probability, the last state is absorbing. Start such models in state 0 with pi.
+
+        Args:
+            n_state (int): Number of states.
+            self_prob (float, optional): Probability of staying in the same state. Defaults to 0.5.
+            max_jump (int, optional): Number of following states reachable in one step. Defaults to 1.
+
+        Returns:
+            SparseTransition: The banded transition matrix with O(n_state * max_jump) entries.
+        """
+        matrix_sources = []
+        matrix_destinations = []
+        matrix_data = []
+        for state in range(n_state):
+            next_states = np.arange(state + 1, min(state + max_jump, n_state - 1) + 1)
+            stay = self_prob if len(next_states) else 1.0
+            matrix_sources.extend([state] * (len(next_states) + 1))
+            matrix_destinations.extend([state, *next_states])
+            matrix_data.extend([stay] + [(1 - stay) / max(len(next_states), 1)] * len(next_states))
+
+        #? Sort the entries by destination, then by source
+        order = np.lexsort((matrix_sources, matrix_destinations))
+        destinations = np.asarray(matrix_destinations)[order]
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(destinations, minlength=n_state))])
+        return cls(n_state, indptr, np.asarray(matrix_sources)[order], np.asarray(matrix_data)[order])
+
+    @property
+    def nnz(self) -> int:
+        """Number of stored entries."""
+        return len(self.data)
+
+    @property
+    def shape(self) -> tuple:
+        """Shape of the equivalent dense matrix."""
+        return (self.n_state, self.n_state)
+
+    def to_dense(self) -> np.ndarray:
+        """Convert to a dense (n_state, n_state) array."""
+        matrix = np.zeros((self.n_state, self.n_state), dtype=np.float64)
+        matrix[self.sources, self.destinations] = self.data
+        return matrix
+
+    def with_data(self, data: np.ndarray) -> "SparseTransition":
+        """Return a matrix with the same sparsity structure and the given entries (nnz,), aligned with data."""
+        return SparseTransition(self.n_state, self.indptr, self.sources, data)
+
+    @property
+    def T(self) -> "SparseTransition":
+        """Transposed matrix, so beta @ transition.T also costs O(nnz). Computed on first access and cached."""
+        if self._transpose is None:
+            #? Entries of the transpose are grouped by their new destination, the source of this matrix
+            order = np.lexsort((self.destinations, self.sources))
+            indptr = np.concatenate([[0], np.cumsum(np.bincount(self.sources, minlength=self.n_state))])
+            self._transpose = SparseTransition(self.n_state, indptr, self.destinations[order], self.data[order])
+        return self._transpose
+
+    def viterbi_step(self, state_log_prob: np.ndarray):
+        """
+        Find the best previous state of every state, like (state_log_prob[..., :, None] + log_transition).max(-2).
+
+        Ties resolve to the smallest source state, like np.argmax on the dense scores.
+
+        Args:
+            state_log_prob (np.ndarray): Log-probabilities of the previous step (..., n_state).
+
+        Returns:
+            tuple: Best scores (..., n_state) and best previous states (..., n_state).
+        """
+        scores = state_log_prob[..., self.sources] + self.log_data
+        best = _reduce_groups(np.maximum, scores, self._starts, self._nonempty, -np.inf)
+        #? First entry of every group reaching the group maximum, states without entries point to state 0
+        is_best = scores == np.take(best, self.destinations, axis=-1)
+        first = _reduce_groups(np.minimum, np.where(is_best, self._positions, self.nnz), self._starts, self._nonempty, -1)
+        backpointers = np.where(first >= 0, self.sources[np.maximum(first, 0)], 0)
+        return best, backpointers
+
+    def __rmatmul__(self, probabilities: np.ndarray) -> np.ndarray:
+        """Return probabilities @ transition for (..., n_state) probabilities."""
+        probabilities = np.asarray(probabilities)
+        return _reduce_groups(np.add, probabilities[..., self.sources] * self.data, self._starts, self._nonempty, 0.0)
+
+    def __matmul__(self, probabilities: np.ndarray) -> np.ndarray:
+        """Return transition @ probabilities for an (n_state,) vector."""
+        probabilities = np.asarray(probabilities)
+        weights = (probabilities[self.destinations] * self.data)[self._by_source]
+        return _reduce_groups(np.add, weights, self._source_starts, self._source_nonempty, 0.0)
+
+    def __repr__(self) -> str:
+        """Return a short description of the matrix."""
+        return f"SparseTransition(n_state={self.n_state}, nnz={self.nnz})"
@@ -1,7 +1,10 @@
 import os
+import multiprocessing
 from rich import print
 import numpy as np
-import math
+from concurrent.futures import Executor, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, Tuple
+from dataset import ShardedDataset, is_sharded_dataset
 
 
 """
@@ -39,23 +42,92 @@ class Config:
 
 
 
+def process_pool(max_workers: int, **kwargs) -> ProcessPoolExecutor:
+    """
+    Create a ProcessPoolExecutor whose workers are started by a forkserver, or spawned where it is unavailable.
+
+    Forking a process where numba's threading layer already runs can deadlock, whatever the backend of the
+    code using the pool, so workers are never forked from the calling process.
+
+    Args:
+        max_workers (int): Number of worker processes.
+        **kwargs: Extra keyword arguments of ProcessPoolExecutor, e.g. initializer and initargs.
+
+    Returns:
+        ProcessPoolExecutor: The executor.
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(method), **kwargs)
+
+
+def bounded_map(executor: Executor, fn: Callable, tasks: Iterable[Tuple], max_in_flight: int,
+                ordered: bool = False) -> Iterator[Tuple]:
+    """
+    Run tasks on an executor keeping at most max_in_flight of them submitted at a time.
+
+    Args:
+        executor (Executor): Executor running the tasks, usually a ProcessPoolExecutor.
+        fn (Callable): Function called as fn(*args) for every task.
+        tasks (Iterable): Iterable of (key, args) tuples, consumed lazily.
+        max_in_flight (int): Maximum number of submitted but unyielded tasks.
+        ordered (bool, optional): Yield in submission order instead of completion order, finished results
+            wait for the older tasks but never more than max_in_flight of them are held. Defaults to False.
+
+    Yields:
+        tuple: (key, result) pairs in completion order, or submission order when ordered.
+    """
+    tasks = iter(tasks)
+    in_flight = {}
+    while True:
+        for key, args in tasks:
+            in_flight[executor.submit(fn, *args)] = key
+            if len(in_flight) >= max_in_flight:
+                break
+        if not in_flight:
+            return
+
+        if ordered:
+            #? Dicts keep insertion order, the first future is the oldest task
+            future = next(iter(in_flight))
+            yield in_flight.pop(future), future.result()
+            continue
+
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield in_flight.pop(future), future.result()
+
+
 class Preprocess:
     """
     Preprocessing class for extracting observations and preparing samples for Hidden Markov Model (HMM) training.
 
     Attributes:
         n_emission (int): Number of possible emissions (quantized angle differences).
+        emission_span (int): Width of each emission bin in degrees.
+        bin_edges (np.ndarray): Inner edges of the emission bins in degrees.
+        code_dtype (np.dtype): Integer type of the emission codes.
 
     Methods:
         __init__(n_emission): Initialize the Preprocess object with the specified number of emissions.
+        emission_name(code): Return the display name of an emission code.
         extract_observations(sample): Extract angle differences from a sample's points.
+        extract_observations_batch(points): Extract angle differences for a batch of samples at once.
         quantize_observation(features): Quantize a list of features into emissions.
         preprocess_single_sample(sample): Preprocess a single sample by extracting observations and quantizing them.
+        iter_observations(dataset, batch_size): Iterate lazily over observation codes and labels of a sharded dataset.
         __call__(data_path): Load data and preprocess samples from the specified data path.
     """
     def __init__(self, n_emission: int = 10) -> None:
         """Initialize the Preprocess object."""
         self.n_emission = n_emission
+        self.emission_span = 180 // n_emission + 1
+        self.bin_edges = np.arange(1, n_emission) * self.emission_span
+        self.code_dtype = np.dtype(np.uint8 if n_emission <= 256 else np.int16)
+
+    @staticmethod
+    def emission_name(code: int) -> str:
+        """Return the display name "E{code}" of an emission code."""
+        return f"E{int(code)}"
 
     def extract_observations(self, sample):
         """
@@ -65,35 +137,35 @@ class Preprocess:
             sample (dict): Sample data containing "points" as an array of points.
 
         Returns:
-            list: List of angle differences between adjacent points.
-        """
-        sample_points = sample["points"]
-        
-        # Add first point to the end of array
-        sample_points = np.concatenate((sample_points, sample_points[0:1]))
-        n_points = len(sample_points)
-        
+            np.ndarray: Angle differences between adjacent points, one per point.
+        """
+        return self.extract_observations_batch(np.asarray(sample["points"])[None])[0]
+
+    def extract_observations_batch(self, points):
+        """
+        Extract angle differences for a batch of samples at once.
+
+        The contour is closed, the last point is connected to the first one.
+
+        Args:
+            points (np.ndarray): Points of all samples with shape (n_sample, n_points, 2).
+
+        Returns:
+            np.ndarray: Angle differences with shape (n_sample, n_points).
+        """
+        points = np.asarray(points, dtype=np.float64)
+
         #? Calculate the angle of each point regarding the next point
-        angles = []
-        for i in range(1,n_points):
-            x0,y0 = sample_points[i-1]
-            x1,y1 = sample_points[i]
-            angle = math.atan2(y1-y0, x1-x0) * 180 / np.pi
-            if angle < 0:
-                angle += 360
-            angles.append(angle)
-
-        diff_angles = []
-        angles = np.concatenate((angles, angles[0:1]))
-        for i in range(1,n_points):
-            diff_angle = angles[i-1] - angles[i]
-            if diff_angle < 0:
-                diff_angle += 360
-
-            if diff_angle > 180:
-                diff_angle -= 180
-
-            diff_angles.append(diff_angle)
+        steps = np.roll(points, -1, axis=1) - points
+        angles = np.arctan2(steps[..., 1], steps[..., 0]) * 180 / np.pi
+        angles[angles < 0] += 360
+
+        #? np.arctan2 may differ from math.atan2 in the last bit, so the folds compare rounded values and U-turns
+        #? are snapped to exactly 180 instead of landing on 180 + eps and folding to ~0
+        diff_angles = angles - np.roll(angles, -1, axis=1)
+        diff_angles[np.round(diff_angles, 9) < 0] += 360
+        diff_angles[np.round(diff_angles, 9) == 180] = 180.0
+        diff_angles[diff_angles > 180] -= 180
         return diff_angles
 
 
@@ -102,14 +174,12 @@ class Preprocess:
         Quantize a list of features into emissions.
 
         Args:
-            features (list): List of numerical features (angle differences).
+            features (list or np.ndarray): Numerical features (angle differences) of any shape.
 
         Returns:
-            list: List of quantized emissions.
+            np.ndarray: Integer emission codes with the same shape as features.
         """
-        emmision_span = 180 // self.n_emission + 1
-        features = [f"E{int(f // emmision_span)}" for f in features]
-        return features
+        return np.digitize(features, self.bin_edges).astype(self.code_dtype)
     
     def preprocess_single_sample(self, sample):
         """
@@ -126,17 +196,47 @@ class Preprocess:
         return {"observations": observations, "label": sample["label"]}
 
 
+    def iter_observations(self, dataset: ShardedDataset, batch_size: int = 65536):
+        """
+        Iterate lazily over observation codes and labels of a sharded dataset.
+
+        Stored codes are used when they were computed with the same n_emission, otherwise they are recomputed
+        from the stored points batch by batch.
+
+        Args:
+            dataset (ShardedDataset): Part of a sharded dataset.
+            batch_size (int, optional): Maximum number of samples per batch. Defaults to 65536.
+
+        Yields:
+            tuple: Observation codes (n_sample, n_observations) and labels (n_sample,).
+        """
+        if dataset.n_emission == self.n_emission:
+            for batch in dataset.iter_batches(batch_size, fields=("observations", "labels")):
+                yield batch["observations"], batch["labels"]
+        else:
+            for batch in dataset.iter_batches(batch_size, fields=("points", "labels")):
+                yield self.quantize_observation(self.extract_observations_batch(batch["points"])), batch["labels"]
+
     def __call__(self, data_path: str = None):
         """
         Load data and preprocess samples from the specified data path.
 
+        A sharded dataset directory is only opened, its samples are read lazily with iter_observations.
+
         Args:
-            data_path (str, optional): Path to the data file. Defaults to None.
+            data_path (str, optional): Path to the data file or sharded dataset directory. Defaults to None.
 
         Returns:
             None
         """
-        data = np.load(data_path, allow_pickle=True)
+        if is_sharded_dataset(data_path):
+            self.train_dataset = ShardedDataset(data_path, "train")
+            self.test_dataset = ShardedDataset(data_path, "test")
+            return
+
+        self.train_dataset = None
+        self.test_dataset = None
+        data = np.load(data_path)
 
         self.raw_train_samples = []
         for points, label in zip(data["points_train"], data["labels_train"]):
@@ -146,9 +246,19 @@ class Preprocess:
         for points, label in zip(data["points_test"], data["labels_test"]):
             self.raw_test_samples.append({"points": points, "label": label})
 
-        self.train_samples = [self.preprocess_single_sample(sample) for sample in self.raw_train_samples]
-        np.random.shuffle(self.train_samples)
-        self.test_samples = [self.preprocess_single_sample(sample) for sample in self.raw_test_samples]
+        #? All samples share the same number of points, so each part is stored as one contiguous code array
+        self.train_observations = self.quantize_observation(self.extract_observations_batch(data["points_train"]))
+        self.train_labels = np.asarray(data["labels_train"])
+        shuffle_idxs = np.random.permutation(len(self.train_labels))
+        self.train_observations = self.train_observations[shuffle_idxs]
+        self.train_labels = self.train_labels[shuffle_idxs]
+        self.test_observations = self.quantize_observation(self.extract_observations_batch(data["points_test"]))
+        self.test_labels = np.asarray(data["labels_test"])
+
+        self.train_samples = [{"observations": observations, "label": label}
+                              for observations, label in zip(self.train_observations, self.train_labels)]
+        self.test_samples = [{"observations": observations, "label": label}
+                             for observations, label in zip(self.test_observations, self.test_labels)]
 
 if __name__ == "__main__":
     pp = Preprocess("./dataset/data.npz")
@@ -1,67 +1,298 @@
-import pygame
-from queue import PriorityQueue
-from square import Node
-from typing import List, Tuple
-
-RED = (255, 0, 0)
-GREEN = (0, 255, 0)
-TURQUOISE = (64, 224, 208)
-PURPLE = (128, 0, 128)
-
-        
-def h(p1, p2):
-    x1, y1 = p1
-    x2, y2 = p2
-    return abs(x1 - x2) + abs(y1 - y2)
-
-def reconstruct_path(came_from, current, draw):
-    while current in came_from:
-        current = came_from[current]
-        current.make_path()
-        draw()
+import numpy as np
+from heapq import heappop, heappush
+from typing import TYPE_CHECKING, Callable, List, NamedTuple, Optional, Tuple
+from grid import DIAGONAL_COST, SQUARE_MOVES, GridGraph
+
+if TYPE_CHECKING:
+    from board import Board
+    from square import Node
+
+#? Straight runs longer than this are scanned with NumPy
+SHORT_SCAN = 64
 
-def a_star_algorithm(draw, grid: List[List[Node]], start: Node, end: Node):
-    count = 0
-    open_set = PriorityQueue()
-    open_set.put((0, count, start))
-    came_from = {}
-    g_score = {node: float("inf") for row in grid for node in row}
-    g_score[start] = 0
-    f_score = {node: float("inf") for row in grid for node in row}
-    f_score[start] = h(start.get_pos(), end.get_pos())
 
-    open_set_hash = {start}
+class SearchResult(NamedTuple):
+    found: bool
+    path: List[int]     # node ids from start to end, empty if no path
+    cost: float         # summed in float64 along the path, g-scores are float32
+    expanded: int       # nodes taken out of the open set, outdated heap entries excluded
+    pushed: int         # entries pushed on the open set heap
 
-    while not open_set.empty():        
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit() 
 
-        current: Node = open_set.get()[2]
-        open_set_hash.remove(current)
+def reconstruct_path(came_from, start: int, end: int) -> List[int]:
+    path = [end]
+    current = end
+    while current != start:
+        current = came_from[current]
+        path.append(current)
+    return path[::-1]
+
+def a_star(graph: GridGraph, start: int, end: int,
+           callback: Optional[Callable] = None, callback_every: int = 1) -> SearchResult:
+    """Find the cheapest path between two node ids, calling callback(opened, closed) every callback_every expansions."""
+    start, end = int(start), int(end)
+    buffers = graph.search_buffers()
+    generation = buffers.next_generation()
+    #? Memoryviews index the arrays with plain Python numbers, much faster than NumPy scalars in this loop
+    g_score = memoryview(buffers.g_score)
+    came_from = memoryview(buffers.came_from)
+    opened_in = memoryview(buffers.opened)
+    closed_in = memoryview(buffers.closed)
+    blocked = memoryview(graph.blocked.reshape(-1))
+    moves = graph.moves
+    heuristic = graph.heuristic
+
+    g_score[start] = 0.0
+    opened_in[start] = generation
+    count = 0
+    open_set = [(heuristic(start, end), count, start)]
+    expanded = 0
+    opened: List[int] = []
+    closed: List[int] = []
+
+    while open_set:
+        current = heappop(open_set)[2]
+        #? Lazy deletion, an improved node is pushed again and its outdated entries are skipped here
+        if closed_in[current] == generation:
+            continue
+        closed_in[current] = generation
+        expanded += 1
 
         if current == end:
-            reconstruct_path(came_from, end, draw)
-            end.make_end()
-            return True
+            if callback is not None:
+                callback(opened, closed)
+            path = reconstruct_path(came_from, start, end)
+            return SearchResult(True, path, graph.path_cost(path), expanded, count + 1)
 
-        for g, neighbor in current.neighbors:
-            temp_g_score = g_score[current] + g
-            if temp_g_score < g_score[neighbor]:
+        current_g = g_score[current]
+        for offset, g in moves(current):
+            neighbor = current + offset
+            if blocked[neighbor] or closed_in[neighbor] == generation:
+                continue
+            temp_g_score = current_g + g
+            is_new = opened_in[neighbor] != generation
+            if is_new or temp_g_score < g_score[neighbor]:
                 came_from[neighbor] = current
                 g_score[neighbor] = temp_g_score
-                f_score[neighbor] = temp_g_score + h(neighbor.get_pos(), end.get_pos())
-
-                if neighbor not in open_set_hash:
-                    count += 1
-                    open_set.put((f_score[neighbor], count, neighbor))
-                    open_set_hash.add(neighbor)
-                    neighbor.make_open()
-        
-        draw()
+                opened_in[neighbor] = generation
+                count += 1
+                heappush(open_set, (temp_g_score + heuristic(neighbor, end), count, neighbor))
+                if is_new and callback is not None:
+                    opened.append(neighbor)
+
+        if callback is not None:
+            closed.append(current)
+            #? Throttle the visualization, the search itself never waits for drawing
+            if expanded % callback_every == 0:
+                callback(opened, closed)
+                opened, closed = [], []
+
+    if callback is not None:
+        callback(opened, closed)
+    return SearchResult(False, [], float("inf"), expanded, count + 1)
+
+def scan_straight(blocked_grid: np.ndarray, row: int, col: int, d_row: int, d_col: int, end_row: int, end_col: int):
+    """Steps from padded (row, col) to the first jump point of a straight line scanned with NumPy, None if blocked."""
+    if d_col:
+        cells = slice(col + 1, None) if d_col > 0 else slice(col - 1, None, -1)
+        line = blocked_grid[row, cells]
+        side_a = blocked_grid[row - 1, cells]
+        side_b = blocked_grid[row + 1, cells]
+        end_steps = (end_col - col) * d_col if end_row == row else 0
+    else:
+        cells = slice(row + 1, None) if d_row > 0 else slice(row - 1, None, -1)
+        line = blocked_grid[cells, col]
+        side_a = blocked_grid[cells, col - 1]
+        side_b = blocked_grid[cells, col + 1]
+        end_steps = (end_row - row) * d_row if end_col == col else 0
+
+    #? The border guarantees a barrier on every line
+    n_free = int(line.argmax())
+    forced = (side_a[:n_free] > side_a[1:n_free + 1]) | (side_b[:n_free] > side_b[1:n_free + 1])
+    steps = int(forced.argmax()) + 1 if n_free and forced.any() else n_free + 1
+    if 0 < end_steps < steps:
+        steps = end_steps
+    return steps if steps <= n_free else None
+
+def jump_straight(blocked_grid: np.ndarray, blocked, node: int, d_row: int, d_col: int, stride: int, end: int):
+    """Steps from node to the first jump point of a straight line, None if blocked. Long runs go to scan_straight."""
+    step = d_row * stride + d_col
+    side = stride if d_col else 1
+    for steps in range(1, SHORT_SCAN + 1):
+        node += step
+        if blocked[node]:
+            return None
+        if node == end:
+            return steps
+        if ((blocked[node - side] and not blocked[node - side + step])
+                or (blocked[node + side] and not blocked[node + side + step])):
+            return steps
+
+    row, col = divmod(node, stride)
+    end_row, end_col = divmod(end, stride)
+    steps = scan_straight(blocked_grid, row, col, d_row, d_col, end_row, end_col)
+    return None if steps is None else steps + SHORT_SCAN
 
-        if current != start:
-            current.make_closed()
+def jump(blocked_grid: np.ndarray, blocked, node: int, d_row: int, d_col: int, stride: int, end: int):
+    """Return (jump point id, steps) moving from node in one direction, or (None, 0) if a barrier comes first."""
+    if not (d_row and d_col):
+        steps = jump_straight(blocked_grid, blocked, node, d_row, d_col, stride, end)
+        if steps is None:
+            return None, 0
+        return node + steps * (d_row * stride + d_col), steps
 
+    d_vertical = d_row * stride
+    steps = 0
+    while True:
+        node += d_vertical + d_col
+        steps += 1
+        if blocked[node]:
+            return None, 0
+        if node == end:
+            return node, steps
+        #? A barrier behind a diagonal move makes the cell beside it reachable only through this node
+        if ((blocked[node - d_col] and not blocked[node - d_col + d_vertical])
+                or (blocked[node - d_vertical] and not blocked[node - d_vertical + d_col])):
+            return node, steps
+        if (jump_straight(blocked_grid, blocked, node, 0, d_col, stride, end) is not None
+                or jump_straight(blocked_grid, blocked, node, d_row, 0, stride, end) is not None):
+            return node, steps
+
+def jump_directions(blocked, node: int, parent: int, stride: int) -> List[Tuple[int, int]]:
+    """Return the pruned (d_row, d_col) search directions of a node reached from parent, all 8 for the start."""
+    if parent == node:
+        return [(d_row, d_col) for d_row, d_col, _ in SQUARE_MOVES]
+    row, col = divmod(node, stride)
+    parent_row, parent_col = divmod(parent, stride)
+    d_row = (row > parent_row) - (row < parent_row)
+    d_col = (col > parent_col) - (col < parent_col)
+
+    if d_row and d_col:
+        directions = [(d_row, 0), (0, d_col), (d_row, d_col)]
+        if blocked[node - d_col]:
+            directions.append((d_row, -d_col))
+        if blocked[node - d_row * stride]:
+            directions.append((-d_row, d_col))
+    elif d_col:
+        directions = [(0, d_col)]
+        if blocked[node - stride]:
+            directions.append((-1, d_col))
+        if blocked[node + stride]:
+            directions.append((1, d_col))
+    else:
+        directions = [(d_row, 0)]
+        if blocked[node - 1]:
+            directions.append((d_row, -1))
+        if blocked[node + 1]:
+            directions.append((d_row, 1))
+    return directions
+
+def expand_jumps(jump_points: List[int], stride: int) -> List[int]:
+    """Fill in the straight and diagonal cells between consecutive jump points."""
+    path = jump_points[:1]
+    for node, next_node in zip(jump_points, jump_points[1:]):
+        row, col = divmod(node, stride)
+        next_row, next_col = divmod(next_node, stride)
+        step = ((next_row > row) - (next_row < row)) * stride + (next_col > col) - (next_col < col)
+        while node != next_node:
+            node += step
+            path.append(node)
+    return path
+
+def jump_point_search(graph: GridGraph, start: int, end: int,
+                      callback: Optional[Callable] = None, callback_every: int = 1) -> SearchResult:
+    """Jump Point Search on a square GridGraph, same moves, costs and callback as a_star. The path has every cell."""
+    if graph.layout != "square":
+        raise ValueError("Jump Point Search needs a square board")
+    start, end = int(start), int(end)
+    buffers = graph.search_buffers()
+    generation = buffers.next_generation()
+    g_score = memoryview(buffers.g_score)
+    came_from = memoryview(buffers.came_from)
+    opened_in = memoryview(buffers.opened)
+    closed_in = memoryview(buffers.closed)
+    blocked = memoryview(graph.blocked.reshape(-1))
+    blocked_grid = graph.blocked
+    stride = graph.stride
+    heuristic = graph.heuristic
+
+    g_score[start] = 0.0
+    came_from[start] = start
+    opened_in[start] = generation
+    count = 0
+    open_set = [(heuristic(start, end), count, start)]
+    expanded = 0
+    opened: List[int] = []
+    closed: List[int] = []
+
+    while open_set:
+        current = heappop(open_set)[2]
+        if closed_in[current] == generation:
+            continue
+        closed_in[current] = generation
+        expanded += 1
+
+        if current == end:
+            if callback is not None:
+                callback(opened, closed)
+            path = expand_jumps(reconstruct_path(came_from, start, end), stride)
+            return SearchResult(True, path, graph.path_cost(path), expanded, count + 1)
+
+        current_g = g_score[current]
+        for d_row, d_col in jump_directions(blocked, current, came_from[current], stride):
+            jump_point, steps = jump(blocked_grid, blocked, current, d_row, d_col, stride, end)
+            if jump_point is None or closed_in[jump_point] == generation:
+                continue
+            temp_g_score = current_g + steps * (DIAGONAL_COST if d_row and d_col else 1.0)
+            is_new = opened_in[jump_point] != generation
+            if is_new or temp_g_score < g_score[jump_point]:
+                came_from[jump_point] = current
+                g_score[jump_point] = temp_g_score
+                opened_in[jump_point] = generation
+                count += 1
+                heappush(open_set, (temp_g_score + heuristic(jump_point, end), count, jump_point))
+                if is_new and callback is not None:
+                    opened.append(jump_point)
+
+        if callback is not None:
+            closed.append(current)
+            if expanded % callback_every == 0:
+                callback(opened, closed)
+                opened, closed = [], []
+
+    if callback is not None:
+        callback(opened, closed)
+    return SearchResult(False, [], float("inf"), expanded, count + 1)
+
+SEARCH_ALGORITHMS = {"astar": a_star, "jps": jump_point_search}
+
+def a_star_algorithm(draw, board: "Board", start: "Node", end: "Node", draw_every: int = 1, algo: str = "astar"):
+    """Run the algo search on the board graph and draw the open nodes, closed nodes and then the path."""
+    if algo not in SEARCH_ALGORITHMS:
+        raise ValueError(f"Unknown algorithm {algo}, expected one of {tuple(SEARCH_ALGORITHMS)}")
+    graph = board.graph
+
+    def node_of(node_id: int) -> "Node":
+        row, col = graph.node_pos(node_id)
+        return board.grid[row][col]
+
+    def show_search(opened, closed):
+        for node_id in opened:
+            node = node_of(node_id)
+            if node != end:
+                node.make_open()
+        for node_id in closed:
+            node = node_of(node_id)
+            if node != start:
+                node.make_closed()
+        draw()
 
-    return False
+    search = SEARCH_ALGORITHMS[algo]
+    result = search(graph, graph.node_id(*start.get_pos()), graph.node_id(*end.get_pos()),
+                    callback=show_search, callback_every=draw_every)
+    if result.found:
+        for node_id in reversed(result.path[:-1]):
+            node_of(node_id).make_path()
+            draw()
+        end.make_end()
+    return result.found
@@ -0,0 +1,125 @@
+import numpy as np
+from typing import List, Tuple
+
+DIAGONAL_COST = 1.41
+LAYOUTS = ("square", "hex")
+
+#? (d_row, d_col, cost) in the order of the old Node.update_neighbors: Up, Up-Right, Right, Down-Right, Down, Down-Left, Left, Up-Left
+SQUARE_MOVES = [(-1, 0, 1.0), (-1, 1, DIAGONAL_COST), (0, 1, 1.0), (1, 1, DIAGONAL_COST),
+                (1, 0, 1.0), (1, -1, DIAGONAL_COST), (0, -1, 1.0), (-1, -1, DIAGONAL_COST)]
+
+#? Odd columns are shifted half a cell down: Up, Down, Up-Right, Down-Right, Down-Left, Up-Left
+HEX_EVEN_COL_MOVES = [(-1, 0, 1.0), (1, 0, 1.0), (-1, 1, 1.0), (0, 1, 1.0), (0, -1, 1.0), (-1, -1, 1.0)]
+HEX_ODD_COL_MOVES = [(-1, 0, 1.0), (1, 0, 1.0), (0, 1, 1.0), (1, 1, 1.0), (1, -1, 1.0), (0, -1, 1.0)]
+
+
+class GridGraph:
+    """Search graph of a square or hex board, node ids index a uint8 occupancy padded with a border of barriers."""
+    def __init__(self, rows: int, cols: int, layout: str = "square") -> None:
+        """Initialize an empty graph."""
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout {layout}, expected one of {LAYOUTS}")
+        self.rows = rows
+        self.cols = cols
+        self.layout = layout
+        self.stride = cols + 2
+        self.size = (rows + 2) * self.stride
+        if self.size > np.iinfo(np.int32).max:
+            raise ValueError(f"A {rows}x{cols} board does not fit int32 node ids")
+
+        self.blocked = np.ones((rows + 2, self.stride), dtype=np.uint8)
+        self.blocked[1:-1, 1:-1] = 0
+        self.occupancy = self.blocked[1:-1, 1:-1]
+
+        if layout == "square":
+            moves = [self._offset_moves(SQUARE_MOVES)] * 2
+        else:
+            moves = [self._offset_moves(HEX_EVEN_COL_MOVES), self._offset_moves(HEX_ODD_COL_MOVES)]
+        #? Indexed by the parity of the column
+        self._moves: List[Tuple[Tuple[int, float], ...]] = moves
+        self._move_costs = [dict(parity_moves) for parity_moves in moves]
+        self._buffers = None
+
+    @classmethod
+    def from_occupancy(cls, occupancy: np.ndarray, layout: str = "square") -> "GridGraph":
+        """Build a graph from a (rows, cols) array, nonzero cells are barriers."""
+        occupancy = np.asarray(occupancy)
+        graph = cls(occupancy.shape[0], occupancy.shape[1], layout=layout)
+        graph.occupancy[:] = occupancy != 0
+        return graph
+
+    def _offset_moves(self, moves) -> Tuple[Tuple[int, float], ...]:
+        """Convert (d_row, d_col, cost) moves to (id offset, cost) pairs."""
+        return tuple((d_row * self.stride + d_col, cost) for d_row, d_col, cost in moves)
+
+    def node_id(self, row: int, col: int) -> int:
+        """Return the id of the cell (row, col)."""
+        return (row + 1) * self.stride + col + 1
+
+    def node_pos(self, node_id: int) -> Tuple[int, int]:
+        """Return the (row, col) of a node id."""
+        row, col = divmod(node_id, self.stride)
+        return row - 1, col - 1
+
+    def set_barrier(self, row: int, col: int, barrier: bool = True):
+        """Add or remove the barrier of the cell (row, col)."""
+        self.occupancy[row, col] = barrier
+
+    def moves(self, node_id: int) -> Tuple[Tuple[int, float], ...]:
+        """Return the (id offset, cost) moves of a node, they depend on the column parity on hex boards."""
+        return self._moves[(node_id % self.stride + 1) & 1]
+
+    def neighbors(self, node_id: int) -> List[Tuple[float, int]]:
+        """Return the (cost, id) pairs of the free neighbours of a node."""
+        blocked = self.blocked.reshape(-1)
+        return [(cost, node_id + offset) for offset, cost in self.moves(node_id) if not blocked[node_id + offset]]
+
+    def heuristic(self, node_id: int, end_id: int) -> float:
+        """Octile distance on square boards and hex distance on hex boards, neither overestimates the path cost."""
+        row, col = divmod(node_id, self.stride)
+        end_row, end_col = divmod(end_id, self.stride)
+        if self.layout == "square":
+            d_row = abs(row - end_row)
+            d_col = abs(col - end_col)
+            return DIAGONAL_COST * min(d_row, d_col) + abs(d_row - d_col)
+
+        #? Axial coordinates of the shifted columns, padded col is col + 1 so the parity is flipped
+        q, end_q = col - 1, end_col - 1
+        r = row - (q - (q & 1)) // 2
+        end_r = end_row - (end_q - (end_q & 1)) // 2
+        d_q = q - end_q
+        d_r = r - end_r
+        return float((abs(d_q) + abs(d_r) + abs(d_q + d_r)) // 2)
+
+    def path_cost(self, path: List[int]) -> float:
+        """Return the cost of a path of adjacent node ids, summed in float64 to avoid the drift of float32 g-scores."""
+        cost = 0.0
+        for node_id, next_id in zip(path, path[1:]):
+            cost += self._move_costs[(node_id % self.stride + 1) & 1][next_id - node_id]
+        return cost
+
+    def search_buffers(self) -> "SearchBuffers":
+        """Return the per-node search state of the graph, allocated on the first call and reused by every search."""
+        if self._buffers is None:
+            self._buffers = SearchBuffers(self.size)
+        return self._buffers
+
+
+class SearchBuffers:
+    """Per-node search state, g_score and came_from are only valid where opened equals the current generation."""
+    def __init__(self, size: int) -> None:
+        """Allocate the arrays of size node ids."""
+        self.g_score = np.zeros(size, dtype=np.float32)
+        self.came_from = np.zeros(size, dtype=np.int32)
+        self.opened = np.zeros(size, dtype=np.uint32)
+        self.closed = np.zeros(size, dtype=np.uint32)
+        self.generation = 0
+
+    def next_generation(self) -> int:
+        """Start a new search and return its generation, the stamps are only cleared when the counter wraps."""
+        self.generation += 1
+        if self.generation > np.iinfo(np.uint32).max:
+            self.opened[:] = 0
+            self.closed[:] = 0
+            self.generation = 1
+        return self.generation
@@ -1,7 +1,8 @@
 import pygame, math
 from board import Board
+from grid import GridGraph
 from shapely.geometry import Point, Polygon
-from typing import List, Tuple
+from typing import List
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -13,14 +14,14 @@ RED = (255, 0, 0)
 GOLD = (255,215,0)
 
 class Node:
-    def __init__(self, row, col, length, hex_sin_len, hex_cos_len, hex_polygon, total_rows, total_cols) -> None:
+    def __init__(self, row, col, length, hex_sin_len, hex_cos_len, hex_polygon, total_rows, total_cols, graph: GridGraph = None) -> None:
         self.row = row
         self.col = col
         self.length = length
         self.color = GRAY
-        self.neighbors: List[Tuple[float, Node]] = []
         self.total_rows = total_rows
         self.total_cols = total_cols
+        self.graph = graph
 
         if col % 2 == 0:
             self.x = length + (col // 2) * 3 * length
@@ -49,11 +50,18 @@ class Node:
     def is_end(self):
         return self.color == GREEN
 
+    def set_graph_barrier(self, barrier: bool):
+        #? Keep the search graph in sync with this cell only, no sweep over the board before a search
+        if self.graph is not None:
+            self.graph.set_barrier(self.row, self.col, barrier)
+
     def reset(self):
         self.color = GRAY
+        self.set_graph_barrier(False)
 
     def make_start(self):
         self.color = ORANGE
+        self.set_graph_barrier(False)
 
     def make_closed(self):
         self.color = GOLD
@@ -63,9 +71,11 @@ class Node:
 
     def make_barrier(self):
         self.color = BLACK
+        self.set_graph_barrier(True)
 
     def make_end(self):
         self.color = GREEN
+        self.set_graph_barrier(False)
 
     def make_path(self):
         self.color = RED
@@ -73,41 +83,6 @@ class Node:
     def draw(self, win):
         pygame.draw.polygon(win, self.color, self.points)
 
-    def update_neighbors(self, grid: List[List["Node"]]):
-        self.neighbors.clear()
-
-        if self.row > 0 and not grid[self.row - 1][self.col].is_barrier(): # Up
-            self.neighbors.append((1.0, grid[self.row - 1][self.col]))
-
-        if self.row < self.total_rows - 1 and not grid[self.row + 1][self.col].is_barrier(): # Down
-            self.neighbors.append((1.0, grid[self.row + 1][self.col]))
-
-        if self.col % 2 == 0:
-            if self.row > 0 and self.col < self.total_cols - 1 and not grid[self.row - 1][self.col + 1].is_barrier(): # Up-Right
-                self.neighbors.append((1.0, grid[self.row - 1][self.col + 1]))
-
-            if self.col < self.total_cols - 1 and not grid[self.row][self.col + 1].is_barrier(): # Down-Right
-                self.neighbors.append((1.0, grid[self.row ][self.col + 1]))
-
-            if self.col > 0 and not grid[self.row][self.col - 1].is_barrier(): # Down-Left
-                self.neighbors.append((1.0, grid[self.row][self.col - 1]))
-
-            if self.row > 0 and self.col > 0 and not grid[self.row - 1][self.col - 1].is_barrier(): # Up-Left
-                self.neighbors.append((1.0, grid[self.row - 1][self.col - 1]))
-        else:        
-            if self.col < self.total_cols - 1 and not grid[self.row][self.col + 1].is_barrier(): # Up-Right
-                self.neighbors.append((1.0, grid[self.row][self.col + 1]))
-
-            if self.row < self.total_rows - 1 and self.col < self.total_cols - 1 and not grid[self.row + 1][self.col + 1].is_barrier(): # Down-Right
-                self.neighbors.append((1.0, grid[self.row + 1][self.col + 1]))
-
-            if self.row < self.total_rows - 1 and self.col > 0 and not grid[self.row + 1][self.col - 1].is_barrier(): # Down-Left
-                self.neighbors.append((1.0, grid[self.row + 1][self.col - 1]))
-
-            if self.col > 0 and not grid[self.row][self.col - 1].is_barrier(): # Up-Left
-                self.neighbors.append((1.0, grid[self.row][self.col - 1]))
-
-
     def __str__(self) -> str:
         return f"({self.row, self.col}) xy=({self.x, self.y}, c={self.color})"
 
@@ -119,6 +94,7 @@ class HexBoard(Board):
         self.cols = cols
         self.length = length
         self.grid: List[List["Node"]] = []
+        self.graph = GridGraph(rows, cols, layout="hex")
         self.width = None
         self.height = None
 
@@ -133,10 +109,11 @@ class HexBoard(Board):
                       (self.length - hex_cos_len, -hex_sin_len)]
 
         self.grid = []
+        self.graph = GridGraph(self.rows, self.cols, layout="hex")
         for row in range(self.rows):
             self.grid.append([])
             for col in range(self.cols):
-                self.grid[row].append(Node(row, col, self.length, hex_sin_len, hex_cos_len, hex_polygon, self.rows, self.cols))
+                self.grid[row].append(Node(row, col, self.length, hex_sin_len, hex_cos_len, hex_polygon, self.rows, self.cols, self.graph))
 
         # update width and height
         self.width = (self.cols // 2) * 3 * self.length + (hex_cos_len if self.cols % 2 == 0 else 2 * self.length)
@@ -6,7 +6,15 @@ from a_star import a_star_algorithm
 from square import SquareBoard
 from hex import HexBoard
 
-def main(win, board):
+def main(win, board, draw_every=1, algo="astar"):
+    def draw():
+        #? Keep the window responsive while the search runs, a_star.py does not know about pygame
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+        board.draw(win)
+
     board.make_grid()
     start = None
     # end = None
@@ -58,11 +66,7 @@ def main(win, board):
 
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE and start:# and end:
-                    for row in board.grid:
-                        for node in row:
-                            node.update_neighbors(board.grid)
-
-                    a_star_algorithm(lambda: board.draw(win), board.grid, start, end)
+                    a_star_algorithm(draw, board, start, end, draw_every=draw_every, algo=algo)
 
                 if event.key == pygame.K_c:
                     start = None
@@ -81,7 +85,11 @@ if __name__ == "__main__":
     parser.add_argument('--rows', '-r', type=int, default=15, help='Number of rows')
     parser.add_argument('--cols', '-c', type=int, default=25, help='Number of columns')
     parser.add_argument('--length', '-l', type=int, default=30, help='Length of each cell in board')
+    parser.add_argument('--draw-every', type=int, default=1, help='Number of node expansions between two redraws')
+    parser.add_argument('--algo', choices=['astar', 'jps'], default='astar', help="Search algorithm, 'jps' (Jump Point Search) needs the square board")
     args = parser.parse_args()
+    if args.algo == "jps" and args.shape != "square":
+        parser.error("--algo jps only supports the square board")
 
     if args.shape == "square":
         board = SquareBoard(rows=args.rows, cols=args.cols, length=args.length)
@@ -98,4 +106,4 @@ if __name__ == "__main__":
     pygame.font.init()  # Initialize the font module
 
     # main(win, board, ROWS, COLS, LENGTH, -1)
-    main(win, board)
+    main(win, board, draw_every=args.draw_every, algo=args.algo)
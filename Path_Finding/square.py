@@ -1,6 +1,7 @@
 import pygame
 from board import Board
-from typing import List, Tuple
+from grid import GridGraph
+from typing import List
 
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
@@ -12,16 +13,16 @@ RED = (255, 0, 0)
 GOLD = (255,215,0)
 
 class Node:
-    def __init__(self, row, col, length, total_rows, total_cols):
+    def __init__(self, row, col, length, total_rows, total_cols, graph: GridGraph = None):
         self.row = row
         self.col = col
         self.x = col * length
         self.y = row * length
         self.color = GRAY
-        self.neighbors: List[Tuple[float, Node]] = []
         self.length = length
         self.total_rows = total_rows
         self.total_cols = total_cols
+        self.graph = graph
 
     def get_pos(self):
         return self.row, self.col
@@ -41,11 +42,18 @@ class Node:
     def is_end(self):
         return self.color == GREEN
 
+    def set_graph_barrier(self, barrier: bool):
+        #? Keep the search graph in sync with this cell only, no sweep over the board before a search
+        if self.graph is not None:
+            self.graph.set_barrier(self.row, self.col, barrier)
+
     def reset(self):
         self.color = GRAY
+        self.set_graph_barrier(False)
 
     def make_start(self):
         self.color = ORANGE
+        self.set_graph_barrier(False)
 
     def make_closed(self):
         self.color = GOLD
@@ -55,9 +63,11 @@ class Node:
 
     def make_barrier(self):
         self.color = BLACK
+        self.set_graph_barrier(True)
 
     def make_end(self):
         self.color = GREEN
+        self.set_graph_barrier(False)
 
     def make_path(self):
         self.color = RED
@@ -65,32 +75,6 @@ class Node:
     def draw(self, win):
         pygame.draw.rect(win, self.color, (self.x, self.y, self.length, self.length))
 
-    def update_neighbors(self, grid: List[List["Node"]]):
-        self.neighbors.clear()
-        if self.row > 0 and not grid[self.row - 1][self.col].is_barrier(): # Up
-            self.neighbors.append((1.0, grid[self.row - 1][self.col]))
-
-        if self.row > 0 and self.col < self.total_cols -1 and not grid[self.row - 1][self.col + 1].is_barrier(): # Up-right
-            self.neighbors.append((1.41, grid[self.row - 1][self.col + 1]))
-
-        if self.col < self.total_cols - 1 and not grid[self.row][self.col + 1].is_barrier(): # Right
-            self.neighbors.append((1.0, grid[self.row][self.col + 1]))
-
-        if self.row < self.total_rows - 1 and self.col < self.total_cols - 1 and not grid[self.row + 1][self.col + 1].is_barrier(): # Down-Right
-            self.neighbors.append((1.41, grid[self.row + 1][self.col + 1]))
-
-        if self.row < self.total_rows - 1 and not grid[self.row + 1][self.col].is_barrier(): # Down
-            self.neighbors.append((1.0, grid[self.row + 1][self.col]))
-
-        if self.col > 0 and self.row < self.total_rows - 1 and not grid[self.row + 1][self.col - 1].is_barrier(): # Down-Left
-            self.neighbors.append((1.41, grid[self.row + 1][self.col - 1]))
-
-        if self.col > 0 and not grid[self.row][self.col - 1].is_barrier(): # Left
-            self.neighbors.append((1.0, grid[self.row][self.col - 1]))
-
-        if self.row > 0 and self.col > 0 and not grid[self.row - 1][self.col - 1].is_barrier(): # Up-Left
-            self.neighbors.append((1.41, grid[self.row - 1][self.col - 1]))
-
     def __lt__(self, other):
         return False
 
@@ -105,15 +89,17 @@ class SquareBoard(Board):
         self.cols = cols
         self.length = length
         self.grid: List[List["Node"]] = []
+        self.graph = GridGraph(rows, cols, layout="square")
         self.width = cols * length
         self.height = rows * length
 
     def make_grid(self):
         self.grid: List[List[Node]] = []
+        self.graph = GridGraph(self.rows, self.cols, layout="square")
         for i in range(self.rows):
             self.grid.append([])
             for j in range(self.cols):
-                node: Node = Node(i, j, self.length, self.rows, self.cols)
+                node: Node = Node(i, j, self.length, self.rows, self.cols, self.graph)
                 self.grid[i].append(node)
     
     def draw_grid(self, win):